@@ -157,6 +157,26 @@ class ST7789(config.RaspberryPi):
         for i in range(0, len(pix), 4096):
             self.spi_writebyte(pix[i:i + 4096])
 
+    def ShowImage_CV_Rows(self, img, y_start, y_end):
+        """Write only rows [y_start, y_end) of a full-screen OpenCV (NumPy) image."""
+
+        imheight, imwidth = img.shape[:2]
+
+        if imwidth != self.width or imheight != self.height:
+            raise ValueError('Image must be same dimensions as display \
+                ({0}x{1}).' .format(self.width, self.height))
+        band = img[y_start:y_end]
+        pix = self.np.zeros((y_end - y_start, self.width, 2), dtype=self.np.uint8)
+        pix[..., [0]] = self.np.add(self.np.bitwise_and(band[..., [0]], 0xF8), self.np.right_shift(band[..., [1]], 5))
+        pix[..., [1]] = self.np.add(self.np.bitwise_and(self.np.left_shift(band[..., [1]], 3), 0xE0), self.np.right_shift(band[..., [2]], 3))
+        pix = pix.flatten().tolist()
+
+        self.SetWindows(0, y_start, self.width, y_end)
+        self.digital_write(self.GPIO_DC_PIN, True)
+
+        for i in range(0, len(pix), 4096):
+            self.spi_writebyte(pix[i:i + 4096])
+
     def clear(self):
         """Clear contents of image buffer"""
         _buffer = [0xff]*(self.width * self.height * 2)
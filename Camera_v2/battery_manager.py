@@ -5,7 +5,7 @@ import time
 from INA219 import INA219
 
 class BatteryManager:
-    def __init__(self, update_interval=60):
+    def __init__(self, update_interval=60, capacity_mah=1000):
         logging.info("Initializing battery sensor...")
         try:
             self.ina219 = INA219(addr=0x43)
@@ -17,6 +17,7 @@ class BatteryManager:
         self.last_battery_percentage = None
         self.last_update_time = 0
         self.update_interval = update_interval
+        self.capacity_mah = capacity_mah  # 電池標稱容量，用於估算剩餘可用時間
 
     def get_battery_percentage(self):
         """取得電池百分比，僅在設定時間間隔內更新數據，其餘時間返回快取值。"""
@@ -49,4 +50,20 @@ class BatteryManager:
         if self.last_battery_percentage is not None:
             return self.last_battery_percentage < threshold
         logging.warning("無法檢查電池狀態，電量數據為空。")
-        return False
\ No newline at end of file
+        return False
+
+    def get_current_ma(self):
+        """讀取目前電流 (mA)。放電時為負值，充電時為正值；無法讀取時回傳 None。"""
+        try:
+            if self.ina219:
+                return self.ina219.getCurrent_mA()
+        except Exception as e:
+            logging.error(f"無法取得電流: {e}")
+        return None
+
+    def get_remaining_capacity_mah(self):
+        """依電量百分比估算剩餘容量 (mAh)。"""
+        battery_percentage = self.get_battery_percentage()
+        if battery_percentage is None:
+            return None
+        return battery_percentage / 100 * self.capacity_mah
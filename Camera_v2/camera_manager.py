@@ -1,37 +1,54 @@
 # camera_manager.py
 
 import logging
-from picamera2 import Picamera2, Preview
-from libcamera import controls
 import cv2
 import time
 import os
 import numpy as np
+from latency_tracker import LatencyTracker
 
 class CameraManager:
-    def __init__(self, display_mgr):
+    def __init__(self, display_mgr, low_latency=True, autotune=True):
         self.picam2 = None
         self.capture_config = None
         self.display_mgr = display_mgr  # 注入 display_mgr
         self.black_image = np.zeros((240, 240, 3), dtype=np.uint8)  # 假設顯示器為 240x240，可調整
 
+        # 預覽期間持續收斂的對焦與曝光狀態，拍照時直接沿用
+        self.focus_locked = False
+        self.converged_metadata = None  # 最近一幀已對焦且曝光已收斂的 metadata，拍攝與 AF-L 只使用這份快照
+        self.last_focused_time = 0
+        self.converged_max_age = 0.5  # 收斂結果的有效時間 (秒)
+        self.last_focus_timed_out = False  # 最近一次拍攝是否因對焦超時而直接拍攝
+
+        # 預覽延遲：low_latency 時每次都等待最新完成的畫面，犧牲部分 FPS 換取較低延遲
+        self.low_latency = low_latency
+        self.last_sensor_timestamp = None
+        self.preview_latency = LatencyTracker("預覽延遲 (感測器至螢幕)")
+
+        # 感測器模式由調校設定檔決定；沒有設定檔且 autotune 時於第一次啟動量測
+        self.autotune = autotune
+        self.preview_stream_size = None
+
     def initialize_camera(self):
         logging.info("Initializing camera...")
         try:
+            # picamera2 載入緩慢，延遲到初始化時才匯入，讓啟動畫面能先顯示
+            from picamera2 import Picamera2, Preview
             self.picam2 = Picamera2()
 
-            if len(self.picam2.sensor_modes) < 3:
-                logging.error("Camera does not have enough sensor modes available")
+            if not self.picam2.sensor_modes:
+                logging.error("Camera does not have any sensor modes available")
                 return False
 
-            mode1 = self.picam2.sensor_modes[1]
-            mode2 = self.picam2.sensor_modes[2]
-            self.preview_config = self.picam2.create_video_configuration(sensor={'output_size': mode1['size'], 'bit_depth': mode1['bit_depth']})
-            self.capture_config = self.picam2.create_still_configuration(sensor={'output_size': mode2['size'], 'bit_depth': mode2['bit_depth']})
+            self.preview_mode, still_mode = self._select_sensor_modes()
+            self.preview_config = self._create_preview_config()
+            self.capture_config = self.picam2.create_still_configuration(sensor={'output_size': still_mode['size'], 'bit_depth': still_mode['bit_depth']})
 
             self.picam2.configure(self.preview_config)
             self.picam2.start_preview(Preview.NULL)
             self.picam2.start()
+            self.enable_continuous_focus()
 
             logging.info("Camera initialized successfully.")
             return True
@@ -39,59 +56,303 @@ class CameraManager:
             logging.error(f"Failed to initialize camera: {e}")
             return False
 
-    def capture_high_res_image_to_memory(self, max_focus_time=3):
-        logging.info("開始高分辨率拍攝...")
+    def _select_sensor_modes(self):
+        """
+        依感測器設定檔選擇預覽與拍攝的感測器模式，回傳 (預覽模式, 拍攝模式)。
+        沒有設定檔時執行調校；調校失敗則使用第二個模式預覽、解析度最高的模式拍攝。
+        """
+        from sensor_autotuner import SensorAutotuner, find_sensor_mode, format_results_table, load_sensor_profile, save_sensor_profile
+        profile = load_sensor_profile(self.picam2)
+        if profile is None and self.autotune:
+            logging.info("找不到感測器設定檔，開始調校感測器模式...")
+            if self.display_mgr and self.display_mgr.disp:
+                self.display_mgr.show_splash("Tuning camera...")
+            try:
+                profile = SensorAutotuner(self.picam2).run()
+                save_sensor_profile(self.picam2, profile)
+                logging.info("\n" + format_results_table(profile))
+            except Exception as e:
+                logging.error(f"感測器調校失敗，使用預設模式: {e}")
+                profile = None
+
+        if profile is not None:
+            stream_size = profile["preview"]["stream_size"]
+            self.preview_stream_size = tuple(stream_size) if stream_size else None
+            logging.info(f"使用感測器設定檔: 預覽 {profile['preview']['mode']} {profile['preview']['stream']}, 拍攝 {profile['still']['mode']}")
+            return find_sensor_mode(self.picam2, profile["preview"]["mode"]), find_sensor_mode(self.picam2, profile["still"]["mode"])
+
+        modes = self.picam2.sensor_modes
+        return modes[min(1, len(modes) - 1)], max(modes, key=lambda mode: mode['size'][0] * mode['size'][1])
+
+    def _create_preview_config(self):
+        """
+        建立預覽設定。低延遲模式下關閉請求佇列，capture_request 只會取得呼叫之後完成的最新畫面，
+        不會拿到在上一輪 SPI 傳輸期間排隊的舊畫面。
+        """
+        mode = self.preview_mode
+        main = {"size": self.preview_stream_size} if self.preview_stream_size else {}
+        return self.picam2.create_video_configuration(main=main, sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']},
+                                                      queue=not self.low_latency)
+
+    def set_low_latency(self, enabled):
+        """在 FPS 與延遲之間切換，會重新設定預覽串流。"""
+        if enabled == self.low_latency:
+            return
+        self.low_latency = enabled
         try:
+            self.preview_config = self._create_preview_config()
+            self.picam2.switch_mode(self.preview_config)
+            if not self.focus_locked:
+                self.enable_continuous_focus()
+            logging.info(f"預覽模式已切換為{'低延遲' if enabled else '高 FPS'}")
+        except Exception as e:
+            logging.error(f"切換預覽模式失敗: {e}")
+
+    def record_display_latency(self):
+        """在畫面送到螢幕之後呼叫，記錄感測器曝光到顯示完成的延遲。"""
+        if self.last_sensor_timestamp is None:
+            return
+        latency = (time.monotonic_ns() - self.last_sensor_timestamp) / 1e9
+        self.last_sensor_timestamp = None
+        # SensorTimestamp 與 CLOCK_MONOTONIC 不一致時忽略異常值
+        if 0 <= latency < 5:
+            self.preview_latency.add(latency)
+        self.preview_latency.maybe_report()
+
+    def get_still_frame_shape(self):
+        """回傳高解析度拍攝轉換為 RGB 後的影像形狀 (高, 寬, 3)。"""
+        width, height = self.capture_config["main"]["size"]
+        return (height, width, 3)
+
+    def enable_continuous_focus(self):
+        """在預覽中啟用連續自動對焦與自動曝光，讓鏡頭在按下快門前就已收斂。"""
+        from libcamera import controls
+        try:
+            self.picam2.set_controls({"AfMode": controls.AfModeEnum.Continuous, "AeEnable": 1})
+            self.focus_locked = False
+            logging.info("預覽中已啟用連續自動對焦與自動曝光")
+        except Exception as e:
+            logging.error(f"啟用連續自動對焦失敗: {e}")
+
+    def capture_preview_frame(self):
+        """擷取一張預覽影像，同時記錄對焦與曝光的 metadata。"""
+        request = self.picam2.capture_request()
+        try:
+            image = request.make_array("main")
+            metadata = request.get_metadata()
+            self.last_sensor_timestamp = metadata.get("SensorTimestamp")
+            self._update_focus_state(metadata)
+        finally:
+            request.release()
+        return image
+
+    def _update_focus_state(self, metadata):
+        from libcamera import controls
+        if self.focus_locked:
+            return
+        if metadata.get("AfState") == controls.AfStateEnum.Focused and metadata.get("AeLocked", True):
+            self.converged_metadata = metadata
+            self.last_focused_time = time.monotonic()
+        else:
+            # 場景改變後 AF 重新掃描，掃描中的鏡頭位置與曝光值不可沿用
+            self.converged_metadata = None
+
+    def is_preview_converged(self):
+        """預覽中的對焦與曝光是否已收斂（或已被鎖定）。"""
+        if self.focus_locked:
+            return True
+        return self.converged_metadata is not None and (time.monotonic() - self.last_focused_time) < self.converged_max_age
+
+    def _converged_controls(self):
+        """將預覽收斂的鏡頭位置與曝光值轉換為手動控制參數。"""
+        from libcamera import controls
+        metadata = self.converged_metadata or {}
+        converged = {"AfMode": controls.AfModeEnum.Manual, "AeEnable": 0}
+        for key in ("LensPosition", "ExposureTime", "AnalogueGain"):
+            if key in metadata:
+                converged[key] = metadata[key]
+        return converged
+
+    def lock_focus_exposure(self):
+        """半按快門：鎖定目前的對焦與曝光。"""
+        if self.converged_metadata is None:
+            logging.warning("預覽尚未完成對焦與曝光，無法鎖定")
+            return False
+        try:
+            locked_controls = self._converged_controls()
+            self.picam2.set_controls(locked_controls)
+            self.focus_locked = True
+            logging.info(f"對焦與曝光已鎖定: {locked_controls}")
+            return True
+        except Exception as e:
+            logging.error(f"鎖定對焦與曝光失敗: {e}")
+            return False
+
+    def unlock_focus_exposure(self):
+        """解除鎖定，回到連續自動對焦與自動曝光。"""
+        self.enable_continuous_focus()
+
+    def _enter_still_mode(self, max_focus_time):
+        """切換至高解析度拍攝模式並完成對焦，回傳是否成功。"""
+        # 預覽已收斂時，直接把鏡頭位置與曝光值帶入拍攝模式，跳過對焦等待
+        converged = self.is_preview_converged()
+        self.last_focus_timed_out = False
+        try:
+            if converged:
+                self.picam2.set_controls(self._converged_controls())
             self.picam2.switch_mode(self.capture_config)
             logging.info("切換相機至高解析度拍攝模式...")
         except Exception as e:
             logging.error(f"切換至高解析模式失敗: {str(e)}")
-            return None
+            return False
 
         try:
-            self.picam2.set_controls({"AfMode": controls.AfModeEnum.Continuous})
-            self.picam2.set_controls({"AeEnable": 1})
-            logging.info("已啟用自動對焦與自動曝光")
-
             self.display_mgr.disp.ShowImage_CV(self.black_image)
 
-            # 等待對焦與曝光完成，並設置最大等待時間
-            logging.info("等待對焦與曝光完成...")
-            start_time = time.time()
-            focus_done = False
+            if converged:
+                logging.info("預覽已完成對焦與曝光，直接拍攝。")
+            else:
+                self.last_focus_timed_out = not self._wait_for_focus(max_focus_time)
+            return True
+        except Exception as e:
+            logging.error(f"設置自動對焦和曝光失敗: {str(e)}")
+            self._return_to_preview()
+            return False
 
-            while not focus_done:
-                elapsed_time = time.time() - start_time
-                if elapsed_time > max_focus_time:
-                    logging.warning("對焦超時，直接拍攝。")
-                    break
+    def _capture_still_frame(self):
+        """在拍攝模式中擷取一張影像並轉換為 RGB，影像無效時回傳 None。"""
+        high_res_image = self.picam2.capture_array()
+        if high_res_image is None or high_res_image.size == 0:
+            logging.error("捕捉的影像為空或無效")
+            return None
+        return self._convert_still(high_res_image)
 
-                metadata = self.picam2.capture_metadata()
-                focus_done = metadata.get("AfState", None) == controls.AfStateEnum.Focused
-                time.sleep(0.1)  # 減少輪詢的頻率
+    def _return_to_preview(self):
+        try:
+            self.picam2.switch_mode(self.preview_config)
+            logging.info("切換相機至低解析度預覽模式")
 
-            focus_duration = time.time() - start_time
-            logging.info(f"對焦完成或超時，對焦花費時間: {focus_duration:.2f} 秒。")
+            # 未鎖定時回到連續對焦，讓下一張也能在預覽中預先收斂
+            if not self.focus_locked:
+                self.enable_continuous_focus()
         except Exception as e:
-            logging.error(f"設置自動對焦和曝光失敗: {str(e)}")
+            logging.error(f"切換回預覽模式失敗: {e}")
+
+    def capture_high_res_image_to_memory(self, max_focus_time=3):
+        logging.info("開始高分辨率拍攝...")
+        if not self._enter_still_mode(max_focus_time):
             return None
 
         try:
-            high_res_image = self.picam2.capture_array()
-            if high_res_image is None or high_res_image.size == 0:
-                logging.error("捕捉的影像為空或無效")
-                return None
+            high_res_image = self._capture_still_frame()
+            if high_res_image is not None:
+                logging.info("圖片捕獲成功")
+            return high_res_image
+        except Exception as e:
+            logging.error(f"拍攝圖片時出現錯誤: {str(e)}")
+            return None
+        finally:
+            self._return_to_preview()
 
-            logging.info("圖片捕獲成功，進行色彩格式轉換")
-            if high_res_image.shape[2] == 4:
-                high_res_image = cv2.cvtColor(high_res_image, cv2.COLOR_BGRA2RGB)
-            elif high_res_image.shape[2] == 3:
-                high_res_image = cv2.cvtColor(high_res_image, cv2.COLOR_BGR2RGB)
+    def capture_burst(self, count, on_frame, max_focus_time=3):
+        """
+        連續擷取 count 張高解析度影像，每張擷取後立即交給 on_frame(image, index) 處理，
+        不會同時保留多張影像。回傳成功處理的張數。
+        """
+        logging.info(f"開始連拍 {count} 張...")
+        if not self._enter_still_mode(max_focus_time):
+            return 0
 
-            self.picam2.switch_mode(self.preview_config)
-            logging.info("切換相機至低解析度預覽模式")
+        captured = 0
+        try:
+            for index in range(count):
+                high_res_image = self._capture_still_frame()
+                if high_res_image is None:
+                    continue
+                on_frame(high_res_image, index)
+                captured += 1
+        except Exception as e:
+            logging.error(f"連拍時出現錯誤: {str(e)}")
+        finally:
+            self._return_to_preview()
+        logging.info(f"連拍完成: {captured}/{count} 張")
+        return captured
 
-            return high_res_image
+    def _wait_for_focus(self, max_focus_time):
+        """預覽尚未收斂時，在拍攝模式中等待對焦與曝光完成，回傳是否對焦成功。"""
+        from libcamera import controls
+        self.picam2.set_controls({"AfMode": controls.AfModeEnum.Continuous})
+        self.picam2.set_controls({"AeEnable": 1})
+        logging.info("已啟用自動對焦與自動曝光")
+
+        # 等待對焦與曝光完成，並設置最大等待時間
+        logging.info("等待對焦與曝光完成...")
+        start_time = time.time()
+        focus_done = False
+
+        while not focus_done:
+            elapsed_time = time.time() - start_time
+            if elapsed_time > max_focus_time:
+                logging.warning("對焦超時，直接拍攝。")
+                break
+
+            metadata = self.picam2.capture_metadata()
+            focus_done = metadata.get("AfState", None) == controls.AfStateEnum.Focused
+            time.sleep(0.1)  # 減少輪詢的頻率
+
+        focus_duration = time.time() - start_time
+        logging.info(f"對焦完成或超時，對焦花費時間: {focus_duration:.2f} 秒。")
+        return focus_done
+
+    def _convert_still(self, high_res_image):
+        """將高解析度影像轉換為 RGB，與一般拍攝的格式一致。"""
+        if high_res_image.shape[2] == 4:
+            return cv2.cvtColor(high_res_image, cv2.COLOR_BGRA2RGB)
+        elif high_res_image.shape[2] == 3:
+            return cv2.cvtColor(high_res_image, cv2.COLOR_BGR2RGB)
+        return high_res_image
+
+    def suspend(self):
+        """停止相機串流以降低功耗，例如縮時攝影的等待期間。"""
+        try:
+            self.picam2.stop()
+            logging.info("相機串流已停止")
+        except Exception as e:
+            logging.error(f"停止相機失敗: {e}")
+
+    def resume_preview(self):
+        """從停止狀態恢復預覽串流。"""
+        try:
+            self.picam2.configure(self.preview_config)
+            self.picam2.start()
+            if not self.focus_locked:
+                self.enable_continuous_focus()
+            logging.info("相機已恢復預覽")
+            return True
+        except Exception as e:
+            logging.error(f"恢復預覽失敗: {e}")
+            return False
+
+    def capture_still_from_stopped(self, max_focus_time=1.5):
+        """
+        相機處於停止狀態時直接以拍攝模式啟動、拍一張後再停止，不經過預覽模式。
+        """
+        try:
+            self.picam2.configure(self.capture_config)
+            self.picam2.start()
+            try:
+                if self.focus_locked:
+                    self.picam2.set_controls(self._converged_controls())
+                else:
+                    self._wait_for_focus(max_focus_time)
+                high_res_image = self.picam2.capture_array()
+            finally:
+                self.picam2.stop()
+
+            if high_res_image is None or high_res_image.size == 0:
+                logging.error("捕捉的影像為空或無效")
+                return None
+            return self._convert_still(high_res_image)
         except Exception as e:
             logging.error(f"拍攝圖片時出現錯誤: {str(e)}")
             return None
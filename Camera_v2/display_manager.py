@@ -30,61 +30,64 @@ class DisplayManager:
         self.frame_count = 0
         self.fps = 0
 
-    def display_image_with_state(self, image, state_text, date_text=None, time_text=None, battery_percentage=None):
+        # 文字層可降低重繪頻率，期間沿用上一幀的畫布
+        self.cached_hud_frame = None
+        self.hud_frame_count = 0
+        self.last_state_text = None
+
+    def display_image_with_state(self, image, state_text, date_text=None, time_text=None, battery_percentage=None, quality=None, overlay=None):
         """
         顯示圖片以及狀態，如日期、時間、電池電量。
+        quality 可指定縮放方式、切片取樣間隔、文字重繪間隔與是否顯示 FPS (見 preview_quality_controller)，
+        未指定時使用最高品質。overlay (見 overlay_manager) 會畫在縮放後的影像上，其成本顯示在 FPS 旁。
         """
         try:
             if image is None or image.size == 0:
                 raise ValueError("無效的影像數據")
 
-            # 強制轉換色彩方案: BGR -> RGB（如有必要）
-            if image.shape[2] == 4:
-                image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
-            elif image.shape[2] == 3:
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
             target_width, target_height = self.disp.width, self.disp.height
+            interpolation = quality["interpolation"] if quality else cv2.INTER_AREA
+            hud_interval = quality["hud_interval"] if quality else 1
+            show_fps = quality["show_fps"] if quality else True
+
+            # 降級時先以切片取樣縮小影像，但不小於顯示區域
+            if quality and quality["decimation"] > 1:
+                decimation = min(quality["decimation"], max(1, image.shape[1] // target_width))
+                if decimation > 1:
+                    image = image[::decimation, ::decimation]
 
             # 圖片縮放
             original_height, original_width = image.shape[:2]
             scale = min(target_width / original_width, 135 / original_height)
             new_size = (int(original_width * scale), int(original_height * scale))
-            resized_image = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+            resized_image = cv2.resize(image, new_size, interpolation=interpolation)
+
+            # 強制轉換色彩方案: BGR -> RGB（如有必要），在縮小後的影像上轉換成本較低
+            if resized_image.shape[2] == 4:
+                resized_image = cv2.cvtColor(resized_image, cv2.COLOR_BGRA2BGR)
+            elif resized_image.shape[2] == 3:
+                resized_image = cv2.cvtColor(resized_image, cv2.COLOR_RGB2BGR)
+
+            if overlay:
+                overlay.draw(resized_image)
+
+            # 文字與電池圖案只在上下的黑邊，未到重繪時間時沿用上一幀的畫布，只更新影像區域
+            self.hud_frame_count += 1
+            # 狀態文字改變 (例如切換拍攝模式) 時立即重繪
+            hud_due = self.cached_hud_frame is None or self.hud_frame_count >= hud_interval or state_text != self.last_state_text
+            if hud_due:
+                self.hud_frame_count = 0
+                self.last_state_text = state_text
+                processed_image = np.zeros((target_height, target_width, 3), dtype=np.uint8)
+            else:
+                processed_image = self.cached_hud_frame
+                processed_image[52:187] = 0
 
             # 建立黑色背景
-            processed_image = np.zeros((target_height, target_width, 3), dtype=np.uint8)
             start_x = (target_width - resized_image.shape[1]) // 2
             start_y = (135 - resized_image.shape[0]) // 2 + 52
             processed_image[start_y:start_y + resized_image.shape[0], start_x:start_x + resized_image.shape[1]] = resized_image
 
-            # 日期文字（僅當日期改變時更新）
-            if date_text != self.last_date_text:
-                self.last_date_text = date_text
-                self.cached_date_layer = self._generate_text_layer(date_text, (10, 30), font_size=0.5, align="left")
-
-            # 疊加日期文字層
-            if self.cached_date_layer is not None:
-                processed_image = cv2.addWeighted(processed_image, 1.0, self.cached_date_layer, 1.0, 0)
-
-            # 時間文字（每次都更新）
-            if time_text:
-                self._draw_text(processed_image, time_text, (target_width - 10, 30), cv2.FONT_HERSHEY_COMPLEX, (255, 255, 255), 1, align="right")
-
-            # 狀態文字
-            self._draw_text(processed_image, state_text, (10, target_height - 10), cv2.FONT_HERSHEY_COMPLEX, (255, 255, 255), 1, align="left")
-
-            # 電池圖案（僅當電量變化時更新）
-            if battery_percentage != self.last_battery_percentage:
-                self.last_battery_percentage = battery_percentage
-                self.cached_battery_image = self._generate_battery_image(battery_percentage)
-
-            # 疊加電池圖案，應用位置偏移
-            if self.cached_battery_image is not None:
-                x_start = target_width - self.cached_battery_image.shape[1] - 10  # 向左移動 10 pixels
-                y_start = target_height - self.cached_battery_image.shape[0] - 5  # 向上移動 10 pixels
-                processed_image[y_start:y_start + self.cached_battery_image.shape[0], x_start:x_start + self.cached_battery_image.shape[1]] = self.cached_battery_image
-
             # 計算 FPS
             self.frame_count += 1
             current_time = time.time()
@@ -94,8 +97,17 @@ class DisplayManager:
                 self.frame_count = 0
                 self.last_frame_time = current_time
 
-            # 在左下角顯示 FPS
-            self._draw_text(processed_image, f"FPS: {self.fps:.2f}", (10, target_height - 30), cv2.FONT_HERSHEY_COMPLEX, (0, 255, 0), 1, align="left")
+            if hud_due:
+                fps_text = None
+                if show_fps:
+                    fps_text = f"FPS: {self.fps:.2f}"
+                    if overlay:
+                        fps_text += f" +{overlay.cost_ms:.1f}ms"
+                elif overlay:
+                    # 最低品質等級不顯示 FPS，但疊加層開啟時負載最高，仍以簡短格式顯示其成本
+                    fps_text = f"{self.fps:.0f}/+{overlay.cost_ms:.1f}ms"
+                self._draw_hud(processed_image, state_text, date_text, time_text, battery_percentage, fps_text)
+            self.cached_hud_frame = processed_image
 
             # 顯示處理後的圖片
             self.disp.ShowImage_CV(processed_image)
@@ -103,6 +115,81 @@ class DisplayManager:
         except Exception as e:
             logging.error(f"Failed to display image: {e}")
 
+    def _draw_hud(self, processed_image, state_text, date_text, time_text, battery_percentage, fps_text):
+        """繪製日期、時間、狀態文字、電池圖案與 FPS。"""
+        target_width, target_height = self.disp.width, self.disp.height
+
+        # 日期文字（僅當日期改變時更新）
+        if date_text != self.last_date_text:
+            self.last_date_text = date_text
+            self.cached_date_layer = self._generate_text_layer(date_text, (10, 30), font_size=0.5, align="left")
+
+        # 疊加日期文字層 (只在上方黑邊，不需要與整張畫面混合)
+        if self.cached_date_layer is not None:
+            cv2.add(processed_image[:52], self.cached_date_layer[:52], dst=processed_image[:52])
+
+        # 時間文字（每次都更新）
+        if time_text:
+            self._draw_text(processed_image, time_text, (target_width - 10, 30), cv2.FONT_HERSHEY_COMPLEX, (255, 255, 255), 1, align="right")
+
+        # 狀態文字
+        self._draw_text(processed_image, state_text, (10, target_height - 10), cv2.FONT_HERSHEY_COMPLEX, (255, 255, 255), 1, align="left")
+
+        # 電池圖案（僅當電量變化時更新）
+        if battery_percentage != self.last_battery_percentage:
+            self.last_battery_percentage = battery_percentage
+            self.cached_battery_image = self._generate_battery_image(battery_percentage)
+
+        # 疊加電池圖案，應用位置偏移
+        if self.cached_battery_image is not None:
+            x_start = target_width - self.cached_battery_image.shape[1] - 10  # 向左移動 10 pixels
+            y_start = target_height - self.cached_battery_image.shape[0] - 5  # 向上移動 10 pixels
+            processed_image[y_start:y_start + self.cached_battery_image.shape[0], x_start:x_start + self.cached_battery_image.shape[1]] = self.cached_battery_image
+
+        # 在左下角顯示 FPS
+        if fps_text:
+            self._draw_text(processed_image, fps_text, (10, target_height - 30), cv2.FONT_HERSHEY_COMPLEX, (0, 255, 0), 1, align="left")
+
+    def display_changed_rows(self, image, previous=None):
+        """
+        顯示已組好的 240x240 RGB 畫面，只透過 SPI 傳送與上一張畫面不同的列；
+        previous 為 None 時傳送整張。回傳實際傳送的列數。
+        """
+        try:
+            if previous is None:
+                self.disp.ShowImage_CV(image)
+                return image.shape[0]
+
+            changed = np.flatnonzero(np.any(image != previous, axis=(1, 2)))
+            if changed.size == 0:
+                return 0
+
+            # 間隔很小的變化列合併為同一段，減少設定視窗的次數
+            breaks = np.flatnonzero(np.diff(changed) > 8)
+            starts = np.concatenate(([changed[0]], changed[breaks + 1]))
+            ends = np.concatenate((changed[breaks], [changed[-1]])) + 1
+            rows_sent = 0
+            for y_start, y_end in zip(starts, ends):
+                self.disp.ShowImage_CV_Rows(image, int(y_start), int(y_end))
+                rows_sent += int(y_end - y_start)
+            return rows_sent
+
+        except Exception as e:
+            logging.error(f"Failed to display rows: {e}")
+            return 0
+
+    def show_splash(self, text):
+        """
+        顯示啟動畫面，在其他硬體初始化完成之前提供即時回饋。
+        """
+        try:
+            splash = np.zeros((self.disp.height, self.disp.width, 3), dtype=np.uint8)
+            self._draw_text(splash, "Pi Zero 2 Camera", (self.disp.width // 2, self.disp.height // 2 - 10), cv2.FONT_HERSHEY_COMPLEX, (255, 255, 255), 1, align="center")
+            self._draw_text(splash, text, (self.disp.width // 2, self.disp.height // 2 + 20), cv2.FONT_HERSHEY_COMPLEX, (0, 255, 0), 1, align="center")
+            self.disp.ShowImage_CV(splash)
+        except Exception as e:
+            logging.error(f"Failed to display splash: {e}")
+
     def _generate_text_layer(self, text, position, font_size=0.5, font=cv2.FONT_HERSHEY_COMPLEX, align="left"):
         """
         生成靜態文字圖層。
@@ -144,6 +231,10 @@ class DisplayManager:
 
         cv2.putText(canvas, text, position, font, 0.5, color, thickness)
 
+    def set_backlight(self, on):
+        """開關背光，待機時關閉以節省電力。"""
+        self.disp.bl_DutyCycle(100 if on else 0)
+
     def clear_display(self):
         self.disp.clear()
 
@@ -0,0 +1,206 @@
+# encode_manager.py
+
+import logging
+import multiprocessing as mp
+import queue
+import time
+from collections import deque
+from multiprocessing import shared_memory
+from threading import Lock, Thread
+
+import cv2
+import numpy as np
+from thumbnail_manager import resize_to_fit, write_thumbnail
+from writeback_manager import write_jpeg
+
+
+def _encode_worker(slot_names, job_queue, result_queue):
+    """工作行程：從共享記憶體讀取影像，編碼 JPEG 並產生縮略圖。"""
+    # 每個槽位只附加一次，之後的工作僅透過佇列傳遞槽位索引與形狀
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+
+            slot_index, shape, dtype, image_path, thumbnail_path = job
+            start_time = time.monotonic()
+            image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=slots[slot_index].buf)
+            ok = False
+            try:
+                # 寫入路徑可能是 RAM 暫存檔，不一定以 .jpg 結尾
+                ok = write_jpeg(image_path, image)
+                if ok and thumbnail_path:
+                    write_thumbnail(thumbnail_path, resize_to_fit(image))
+            except Exception as e:
+                logging.error(f"工作行程保存圖片失敗: {e}")
+            finally:
+                # 釋放對共享記憶體的引用，之後槽位才能安全重用
+                del image
+            result_queue.put((slot_index, image_path, ok, time.monotonic() - start_time))
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+class EncodeManager:
+    def __init__(self, frame_shape, num_workers=2, num_slots=2, dtype=np.uint8):
+        """
+        初始化多行程編碼管理器。
+        frame_shape 為高解析度影像的形狀，每個共享記憶體槽位依此大小配置。
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_size = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.on_saved = None  # 保存完成時的回呼 (image_path, ok)
+        self.job_callbacks = {}  # 個別工作的回呼，以槽位索引對應
+
+        # 使用 spawn 避免在相機與 SPI 已開啟的狀態下 fork
+        ctx = mp.get_context("spawn")
+        self.slots = [shared_memory.SharedMemory(create=True, size=self.slot_size) for _ in range(num_slots)]
+        self.free_slots = queue.Queue()
+        for index in range(num_slots):
+            self.free_slots.put(index)
+
+        self.job_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        slot_names = [shm.name for shm in self.slots]
+        self.workers = [ctx.Process(target=_encode_worker, args=(slot_names, self.job_queue, self.result_queue), daemon=True)
+                        for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+        self.pending = 0
+        self.pending_lock = Lock()
+        self.encode_times = deque(maxlen=50)
+        self.result_thread = Thread(target=self._collect_results, daemon=True)
+        self.result_thread.start()
+        logging.info(f"編碼工作行程已啟動: {num_workers} 個行程, {num_slots} 個共享記憶體槽位 ({self.slot_size / 1e6:.1f} MB)")
+
+    def submit(self, image, image_path, thumbnail_path=None, timeout=0, on_saved=None):
+        """
+        將影像複製到空閒的共享記憶體槽位並交給工作行程保存。
+        沒有空閒槽位或影像大小不符時回傳 False，由呼叫端改用行程內保存。
+        預設不等待槽位 (由 UI 執行緒呼叫)，timeout 大於 0 時最多等待該秒數。
+        on_saved 可覆寫這張影像保存完成時的回呼。
+        """
+        if image.dtype != self.dtype or image.nbytes > self.slot_size:
+            logging.warning(f"影像大小 {image.shape} 超出共享記憶體槽位，改用行程內保存")
+            return False
+
+        try:
+            slot_index = self.free_slots.get(timeout=timeout) if timeout > 0 else self.free_slots.get_nowait()
+        except queue.Empty:
+            logging.warning("沒有空閒的共享記憶體槽位，改用行程內保存")
+            return False
+
+        view = np.ndarray(image.shape, dtype=self.dtype, buffer=self.slots[slot_index].buf)
+        np.copyto(view, image)
+        del view
+
+        with self.pending_lock:
+            self.pending += 1
+            self.job_callbacks[slot_index] = on_saved or self.on_saved
+        self.job_queue.put((slot_index, image.shape, self.dtype.str, image_path, thumbnail_path))
+        return True
+
+    def _collect_results(self):
+        """在背景接收工作行程的結果，歸還槽位並觸發回呼。"""
+        while True:
+            result = self.result_queue.get()
+            if result is None:
+                break
+
+            slot_index, image_path, ok, encode_time = result
+            with self.pending_lock:
+                self.pending -= 1
+                callback = self.job_callbacks.pop(slot_index, None)
+            self.free_slots.put(slot_index)
+            self.encode_times.append(encode_time)
+            if ok:
+                logging.info(f"圖片已寫入: {image_path} (編碼 {encode_time:.2f} 秒)")
+            else:
+                logging.error(f"保存圖片失敗: {image_path}")
+
+            if callback:
+                try:
+                    callback(image_path, ok)
+                except Exception as e:
+                    logging.error(f"保存回呼執行失敗: {e}")
+
+    def wait_until_idle(self, timeout=None):
+        """等待所有已提交的影像保存完成。"""
+        start_time = time.monotonic()
+        while self.pending > 0:
+            if timeout is not None and time.monotonic() - start_time > timeout:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self):
+        """停止工作行程並釋放共享記憶體。"""
+        self.wait_until_idle(timeout=10)
+        for _ in self.workers:
+            self.job_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.result_queue.put(None)
+        self.result_thread.join(timeout=1)
+
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
+        logging.info("編碼工作行程已關閉。")
+
+
+def _run_benchmark(num_saves=6, frame_shape=(2592, 4608, 3), preview_shape=(720, 1280, 3)):
+    """以合成影像比較行程內保存與多行程保存時的預覽幀率。"""
+    import os
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=frame_shape, dtype=np.uint8)
+    preview = rng.integers(0, 256, size=preview_shape, dtype=np.uint8)
+
+    def simulate_preview(is_busy):
+        # 模擬預覽迴圈：縮放 + 顏色轉換，直到所有保存完成為止
+        frames = 0
+        start_time = time.monotonic()
+        while is_busy():
+            small = cv2.resize(preview, (240, 135), interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(small, cv2.COLOR_RGB2BGR)
+            frames += 1
+        elapsed = time.monotonic() - start_time
+        return frames / elapsed, elapsed
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        threads = [Thread(target=cv2.imwrite, args=(os.path.join(tmp_dir, f"t{i}.jpg"), frame)) for i in range(num_saves)]
+        for thread in threads:
+            thread.start()
+        fps, elapsed = simulate_preview(lambda: any(thread.is_alive() for thread in threads))
+        print(f"執行緒保存: 預覽 {fps:.1f} FPS, {num_saves} 張耗時 {elapsed:.2f} 秒")
+
+        # 與實際使用相同的設定 (2 個槽位)；槽位數若與張數相同，在 512 MB 的 Pi Zero 2 上會超出 /dev/shm 的上限
+        encode_mgr = EncodeManager(frame_shape)
+        try:
+            def feed():
+                # 沒有空閒槽位時等待，模擬連拍時依序交給工作行程
+                for i in range(num_saves):
+                    if not encode_mgr.submit(frame, os.path.join(tmp_dir, f"p{i}.jpg"), timeout=60):
+                        logging.error(f"第 {i + 1} 張未能交給工作行程")
+
+            feeder = Thread(target=feed)
+            feeder.start()
+            fps, elapsed = simulate_preview(lambda: feeder.is_alive() or encode_mgr.pending > 0)
+            feeder.join()
+            print(f"多行程保存: 預覽 {fps:.1f} FPS, {num_saves} 張耗時 {elapsed:.2f} 秒")
+        finally:
+            encode_mgr.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    _run_benchmark()
@@ -0,0 +1,111 @@
+# gallery_grid_manager.py
+
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from thumbnail_manager import resize_to_fit
+
+class GalleryGridManager:
+    def __init__(self, thumbnail_mgr, screen_size=(240, 240), cols=3, rows=4, header_height=24, atlas_capacity=48):
+        """
+        相簿格狀檢視 (contact sheet)。每張照片只在第一次出現時由縮略圖縮成小圖並存到磁碟，
+        之後載入到記憶體中的圖集 (atlas)；組合畫面時只做切片複製，不再解碼或縮放。
+        """
+        self.thumbnail_mgr = thumbnail_mgr
+        self.screen_width, self.screen_height = screen_size
+        self.cols = cols
+        self.rows = rows
+        self.header_height = header_height
+        self.cell_width = self.screen_width // cols
+        self.cell_height = (self.screen_height - header_height) // rows
+
+        # 小圖維持縮略圖的 16:9 比例，四周留 2 px 給選取框
+        self.tile_width = self.cell_width - 4
+        self.tile_height = min(self.cell_height - 4, self.tile_width * 9 // 16)
+        self.tile_dir = os.path.join(thumbnail_mgr.thumbnail_dir, f"grid_{self.tile_width}x{self.tile_height}")
+        os.makedirs(self.tile_dir, exist_ok=True)
+
+        # 圖集：固定大小的連續緩衝區，以 LRU 管理每個槽位
+        self.atlas = np.zeros((atlas_capacity, self.tile_height, self.tile_width, 3), dtype=np.uint8)
+        self.slots = OrderedDict()  # 影像路徑 -> 槽位
+        self.free_slots = list(range(atlas_capacity))
+        self.placeholder = np.full((self.tile_height, self.tile_width, 3), 48, dtype=np.uint8)
+
+    @property
+    def page_size(self):
+        return self.cols * self.rows
+
+    def _tile_path(self, image_path):
+        return os.path.join(self.tile_dir, os.path.basename(self.thumbnail_mgr.get_thumbnail_path(image_path)))
+
+    def _build_tile(self, image_path):
+        """由縮略圖產生小圖並保存，每張照片只會執行一次。"""
+        thumbnail = self.thumbnail_mgr.load_or_generate_thumbnail(image_path)
+        if thumbnail is None:
+            return None
+        resized = resize_to_fit(thumbnail, self.tile_width, self.tile_height)
+        tile = np.zeros((self.tile_height, self.tile_width, 3), dtype=np.uint8)
+        y = (self.tile_height - resized.shape[0]) // 2
+        x = (self.tile_width - resized.shape[1]) // 2
+        tile[y:y + resized.shape[0], x:x + resized.shape[1]] = resized
+        if not cv2.imwrite(self._tile_path(image_path), tile):
+            logging.error(f"Failed to save grid tile: {image_path}")
+        return tile
+
+    def get_tile(self, image_path):
+        """回傳圖集中的小圖 (RGB)；無法產生時回傳 None。"""
+        slot = self.slots.get(image_path)
+        if slot is not None:
+            self.slots.move_to_end(image_path)
+            return self.atlas[slot]
+
+        tile = cv2.imread(self._tile_path(image_path))
+        if tile is None or tile.shape[:2] != (self.tile_height, self.tile_width):
+            tile = self._build_tile(image_path)
+            if tile is None:
+                return None
+
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            _, slot = self.slots.popitem(last=False)
+        # 縮略圖以 BGR 保存，載入圖集時轉為螢幕使用的 RGB，組合時不需再轉換
+        cv2.cvtColor(tile, cv2.COLOR_BGR2RGB, dst=self.atlas[slot])
+        self.slots[image_path] = slot
+        return self.atlas[slot]
+
+    def clamp_top_row(self, top_row, selected, total):
+        """調整第一列的位置，讓選取的照片保持在畫面內。"""
+        last_row = max(0, (total - 1) // self.cols - self.rows + 1)
+        row = selected // self.cols
+        if row < top_row:
+            top_row = row
+        elif row >= top_row + self.rows:
+            top_row = row - self.rows + 1
+        return max(0, min(top_row, last_row))
+
+    def compose(self, image_paths, top_row, selected, header_text):
+        """組合一頁格狀畫面，回傳可直接送到螢幕的 RGB 影像。"""
+        start_time = time.monotonic()
+        canvas = np.zeros((self.screen_height, self.screen_width, 3), dtype=np.uint8)
+        cv2.putText(canvas, header_text, (10, self.header_height - 7), cv2.FONT_HERSHEY_COMPLEX, 0.5, (255, 255, 255), 1)
+
+        first_index = top_row * self.cols
+        for index in range(first_index, min(first_index + self.page_size, len(image_paths))):
+            cell = index - first_index
+            cell_x = (cell % self.cols) * self.cell_width
+            cell_y = self.header_height + (cell // self.cols) * self.cell_height
+            x = cell_x + (self.cell_width - self.tile_width) // 2
+            y = cell_y + (self.cell_height - self.tile_height) // 2
+
+            tile = self.get_tile(image_paths[index])
+            canvas[y:y + self.tile_height, x:x + self.tile_width] = self.placeholder if tile is None else tile
+            if index == selected:
+                cv2.rectangle(canvas, (x - 2, y - 2), (x + self.tile_width + 1, y + self.tile_height + 1), (0, 255, 0), 2)
+
+        logging.debug(f"格狀畫面組合耗時 {(time.monotonic() - start_time) * 1000:.1f} ms")
+        return canvas
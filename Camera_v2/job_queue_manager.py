@@ -0,0 +1,187 @@
+# job_queue_manager.py
+
+import json
+import logging
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+
+class JobQueueManager:
+    def __init__(self, db_path, battery_mgr=None, key_mgr=None, idle_timeout=5, charging_current_ma=50, poll_interval=0.5):
+        """
+        持久化的背景工作佇列 (SQLite)，程式重啟後未完成的工作仍會保留。
+        工作以 (kind, key) 合併：同一張照片重複排入同類工作只會保留一筆，並取較高的優先權。
+        排程器只在閒置 (一段時間沒有按鍵且不在即時預覽中) 或充電中才執行工作。
+        """
+        self.db_path = db_path
+        self.battery_mgr = battery_mgr
+        self.key_mgr = key_mgr
+        self.idle_timeout = idle_timeout
+        self.charging_current_ma = charging_current_ma
+        self.poll_interval = poll_interval
+
+        self.lock = Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                payload TEXT,
+                created REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                generation INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (kind, key)
+            )""")
+        # 舊版資料庫沒有 generation 欄位時補上
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if "generation" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+        self.conn.commit()
+
+        self.handlers = {}
+        self.pending_count = self._count_pending()
+        self.completed_count = 0
+        self.max_attempts = 3
+        self.paused = False
+        self.foreground_busy = False
+        self.running = False
+        self.wake_event = Event()
+        self.thread = None
+        self.last_charging_check = 0
+        self.charging = False
+        if self.pending_count:
+            logging.info(f"背景工作佇列中有 {self.pending_count} 筆未完成的工作")
+
+    def _count_pending(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def register_handler(self, kind, handler):
+        """註冊工作處理函式 handler(key, payload)。"""
+        self.handlers[kind] = handler
+
+    def enqueue(self, kind, key, priority=0, payload=None):
+        """排入工作；相同 (kind, key) 的工作會合併為一筆。"""
+        self.enqueue_many([(kind, key, priority, payload)])
+
+    def enqueue_many(self, jobs):
+        """以單一交易排入多筆 (kind, key, priority, payload) 工作，SD 卡上只需一次提交。"""
+        created = time.time()
+        rows = [(kind, key, priority, json.dumps(payload) if payload is not None else None, created)
+                for kind, key, priority, payload in jobs]
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany("""
+                INSERT INTO jobs (kind, key, priority, payload, created) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET
+                    priority = MAX(priority, excluded.priority),
+                    payload = excluded.payload,
+                    attempts = 0,
+                    generation = generation + 1""", rows)
+            self.conn.commit()
+            self.pending_count = self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def start(self):
+        """啟動排程器執行緒。"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self._run_loop, daemon=True)
+        self.thread.start()
+
+    def pause(self):
+        """錄影或縮時拍攝等忙碌期間暫停背景工作。"""
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.wake_event.set()
+
+    def set_foreground_busy(self, busy):
+        """由主循環設定目前畫面是否需要 CPU (例如即時預覽)，忙碌時不算閒置。"""
+        if self.foreground_busy and not busy:
+            self.wake_event.set()
+        self.foreground_busy = busy
+
+    def is_charging(self):
+        current_time = time.monotonic()
+        if self.battery_mgr and current_time - self.last_charging_check > 5:
+            self.last_charging_check = current_time
+            current_ma = self.battery_mgr.get_current_ma()
+            self.charging = current_ma is not None and current_ma > self.charging_current_ma
+        return self.charging
+
+    def is_idle(self):
+        if self.foreground_busy:
+            return False
+        if self.key_mgr is None:
+            return True
+        # KeyManager 以 time.time() 記錄按鍵時間
+        return time.time() - self.key_mgr.last_activity_time >= self.idle_timeout
+
+    def can_run(self):
+        return not self.paused and (self.is_idle() or self.is_charging())
+
+    def _next_job(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT kind, key, payload, attempts, generation FROM jobs ORDER BY priority DESC, created ASC LIMIT 1").fetchone()
+
+    def _finish_job(self, kind, key, ok, attempts, generation):
+        """
+        結束一筆工作。執行期間同一 (kind, key) 又被排入時 generation 會改變，
+        此時保留該筆工作讓它再執行一次，不會刪掉新的要求。
+        """
+        with self.lock:
+            if ok or attempts + 1 >= self.max_attempts:
+                self.conn.execute("DELETE FROM jobs WHERE kind = ? AND key = ? AND generation = ?", (kind, key, generation))
+            else:
+                self.conn.execute("UPDATE jobs SET attempts = attempts + 1, priority = priority - 1 WHERE kind = ? AND key = ? AND generation = ?",
+                                  (kind, key, generation))
+            self.conn.commit()
+            self.pending_count = self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def _run_loop(self):
+        while self.running:
+            if not self.can_run():
+                self.wake_event.wait(self.poll_interval)
+                self.wake_event.clear()
+                continue
+
+            job = self._next_job()
+            if job is None:
+                self.wake_event.wait(self.poll_interval * 4)
+                self.wake_event.clear()
+                continue
+
+            kind, key, payload, attempts, generation = job
+            handler = self.handlers.get(kind)
+            ok = False
+            start_time = time.monotonic()
+            if handler is None:
+                logging.warning(f"沒有對應的背景工作處理函式: {kind}")
+            else:
+                try:
+                    handler(key, json.loads(payload) if payload else None)
+                    ok = True
+                except Exception as e:
+                    logging.error(f"背景工作失敗 {kind}:{key}: {e}")
+            self._finish_job(kind, key, ok, attempts, generation)
+            if ok:
+                self.completed_count += 1
+                logging.info(f"背景工作完成 {kind}:{key} ({time.monotonic() - start_time:.2f} 秒)，"
+                             f"已完成 {self.completed_count}，剩餘 {self.pending_count}")
+
+    def get_progress(self):
+        """回傳 (本次已完成數, 剩餘數)。"""
+        return self.completed_count, self.pending_count
+
+    def close(self):
+        self.running = False
+        self.wake_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+        with self.lock:
+            self.conn.close()
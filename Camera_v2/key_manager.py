@@ -4,9 +4,11 @@ import time
 from time import time as timer
 
 class KeyManager:
-    def __init__(self, disp):
+    def __init__(self, disp, repeat_delay=0.4, repeat_rate=8, max_repeat_rate=200, repeat_accel_time=0.7):
         """
         初始化按鍵管理器。
+        按住按鍵超過 repeat_delay 秒後開始連續觸發，速率由 repeat_rate (次/秒) 起，
+        每 repeat_accel_time 秒加倍，最高 max_repeat_rate。
         """
         self.disp = disp
         self.key_last_pressed_time = {
@@ -17,7 +19,15 @@ class KeyManager:
             disp.GPIO_KEY_RIGHT_PIN: 0,
             disp.GPIO_KEY_UP_PIN: 0,
             disp.GPIO_KEY_DOWN_PIN: 0,
+            disp.GPIO_KEY_PRESS_PIN: 0,
         }
+        self.last_activity_time = timer()  # 最近一次按鍵的時間，用於判斷是否閒置
+
+        self.repeat_delay = repeat_delay
+        self.repeat_rate = repeat_rate
+        self.max_repeat_rate = max_repeat_rate
+        self.repeat_accel_time = repeat_accel_time
+        self.key_hold_state = {}  # 按住中的按鍵 -> [按下時間, 上次檢查時間, 累積的步數]
 
     def check_key_pressed(self, key_pin, debounce_delay=0.15):
         """
@@ -27,5 +37,43 @@ class KeyManager:
         if self.disp.digital_read(key_pin) == 1:  # 直接檢查 GPIO pin 狀態
             if (current_time - self.key_last_pressed_time[key_pin]) > debounce_delay:
                 self.key_last_pressed_time[key_pin] = current_time
+                self.last_activity_time = current_time
                 return True
-        return False
\ No newline at end of file
+        return False
+
+    def check_key_repeat(self, key_pin, debounce_delay=0.15):
+        """
+        支援按住加速的按鍵檢查，回傳本次應移動的步數 (0 表示沒有動作)。
+        按下時立即回傳 1；持續按住時依按住的時間加速，每次呼叫可能回傳多步。
+        需要每個循環都呼叫，才能偵測到放開按鍵。
+        """
+        current_time = timer()
+        if self.disp.digital_read(key_pin) != 1:
+            self.key_hold_state.pop(key_pin, None)
+            return 0
+
+        self.last_activity_time = current_time
+        hold = self.key_hold_state.get(key_pin)
+        if hold is None:
+            if (current_time - self.key_last_pressed_time[key_pin]) <= debounce_delay:
+                return 0
+            self.key_last_pressed_time[key_pin] = current_time
+            self.key_hold_state[key_pin] = [current_time, current_time, 0.0]
+            return 1
+
+        press_time, last_time, pending_steps = hold
+        repeat_start = press_time + self.repeat_delay
+        hold[1] = current_time
+        if current_time < repeat_start:
+            return 0
+
+        rate = min(self.max_repeat_rate, self.repeat_rate * 2 ** ((current_time - repeat_start) / self.repeat_accel_time))
+        pending_steps += rate * (current_time - max(last_time, repeat_start))
+        steps = int(pending_steps)
+        hold[2] = pending_steps - steps
+        return steps
+
+    def is_key_repeating(self, key_pin):
+        """按鍵是否已按住超過 repeat_delay，進入連續觸發。"""
+        hold = self.key_hold_state.get(key_pin)
+        return hold is not None and timer() - hold[0] >= self.repeat_delay
\ No newline at end of file
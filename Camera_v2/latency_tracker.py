@@ -0,0 +1,50 @@
+# latency_tracker.py
+
+import logging
+import time
+from collections import deque
+
+class LatencyTracker:
+    def __init__(self, name, window=120, report_interval=10):
+        """
+        以滑動視窗統計延遲或處理時間，並定期輸出到日誌。
+        """
+        self.name = name
+        self.samples = deque(maxlen=window)
+        self.report_interval = report_interval
+        self.last_report_time = time.monotonic()
+        self.total_count = 0
+
+    def add(self, seconds):
+        """加入一筆以秒為單位的量測值。"""
+        self.samples.append(seconds)
+        self.total_count += 1
+
+    def get_stats(self):
+        """回傳視窗內的統計數據 (毫秒)，沒有資料時回傳 None。"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        count = len(ordered)
+        return {
+            "count": self.total_count,
+            "mean_ms": sum(ordered) / count * 1000,
+            "p50_ms": ordered[count // 2] * 1000,
+            "p95_ms": ordered[min(count - 1, int(count * 0.95))] * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
+
+    def format_stats(self):
+        stats = self.get_stats()
+        if stats is None:
+            return f"{self.name}: 無資料"
+        return (f"{self.name}: 平均 {stats['mean_ms']:.1f} ms, p50 {stats['p50_ms']:.1f} ms, "
+                f"p95 {stats['p95_ms']:.1f} ms, 最大 {stats['max_ms']:.1f} ms ({stats['count']} 筆)")
+
+    def maybe_report(self):
+        """距離上次輸出超過 report_interval 秒時，將統計寫入日誌。"""
+        current_time = time.monotonic()
+        if self.report_interval and current_time - self.last_report_time >= self.report_interval:
+            self.last_report_time = current_time
+            if self.samples:
+                logging.info(self.format_stats())
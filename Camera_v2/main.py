@@ -1,36 +1,145 @@
 # main.py
 
+import time
+BOOT_START_TIME = time.monotonic()  # 開機計時起點，需在載入其他模組之前記錄
+
 import os
 import logging
-from camera_manager import CameraManager
-from key_manager import KeyManager
-from display_manager import DisplayManager
-from state_machine import StateMachine
-from battery_manager import BatteryManager
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+# 將 JPEG 編碼與縮略圖交給獨立的工作行程，避免與預覽迴圈爭用 GIL
+USE_ENCODE_WORKERS = True
+# 照片先寫入 RAM 暫存區再分批寫回 SD 卡；預算用完時改為直接寫入 (設為 0 可停用)
+WRITEBACK_RAM_BUDGET_MB = 64
+# 縮略圖、相簿更新與清晰度分析延後到閒置或充電時，由持久化的背景工作佇列處理
+USE_JOB_QUEUE = True
+# 預覽只取最新完成的畫面以降低延遲；設為 False 可換取較高的 FPS
+PREVIEW_LOW_LATENCY = True
+# 沒有感測器設定檔時，第一次啟動會先量測各感測器模式並保存最佳組合 (約需一分鐘)
+# 之後可執行 resolution.py 查看結果，或以 resolution.py --autotune 重新調校
+SENSOR_AUTOTUNE = True
+# 預覽的目標幀率，背景工作佔用 CPU 時會自動降低預覽品質以維持此幀率
+PREVIEW_TARGET_FPS = 15
+# 本地 HTTP 服務 (MJPEG 預覽、遠端拍攝、相片下載) 的連接埠，設為 None 可停用
+WEB_SERVER_PORT = 8000
+# HTTP 服務監聽的位址；設為某個網路介面的 IP (例如 USB 網路的 "10.55.0.1") 可只在該介面上提供服務
+WEB_SERVER_HOST = "0.0.0.0"
+# 遠端拍攝與匯出確認所需的存取權杖；設為 None 時第一次啟動會產生隨機權杖並保存在此檔案
+WEB_ACCESS_TOKEN = None
+WEB_TOKEN_PATH = os.path.join(os.path.expanduser("~"), ".pi_camera", "web_token")
+# 是否允許匯出客戶端在驗證後刪除相機上的照片 (預設關閉)
+OFFLOAD_ALLOW_DELETE = False
+# 縮時攝影的拍攝間隔 (秒)，可設定為數秒到數小時
+TIMELAPSE_INTERVAL = 10
+# 夜景模式連拍並疊加降噪的張數
+NIGHT_FRAMES = 8
+# 清晰優先模式連拍的張數，只保存最清晰的一張
+SHARP_FRAMES = 5
+
+def timed_init(name, func, *args, **kwargs):
+    """執行初始化函式並記錄耗時。"""
+    start_time = time.monotonic()
+    result = func(*args, **kwargs)
+    logging.info(f"{name} 初始化耗時 {time.monotonic() - start_time:.2f} 秒")
+    return result
+
+def init_camera(disp_mgr):
+    # picamera2 的載入最慢，延遲到背景執行緒中進行
+    from camera_manager import CameraManager
+    cam_mgr = CameraManager(disp_mgr, low_latency=PREVIEW_LOW_LATENCY, autotune=SENSOR_AUTOTUNE)
+    return cam_mgr if cam_mgr.initialize_camera() else None
+
+def init_battery():
+    from battery_manager import BatteryManager
+    battery_mgr = BatteryManager(update_interval=60)
+    battery_mgr.get_battery_percentage()  # 先讀取一次，讓第一幀就有電量顯示
+    return battery_mgr
+
+def init_catalog(save_dir):
+    from thumbnail_manager import ThumbnailManager
+    return ThumbnailManager(save_dir, os.path.join(save_dir, "thumbnails"))
+
+def start_deferred_services(state_machine, cam_mgr, save_dir):
+    """等待第一個預覽畫面顯示後，再啟動非必要的背景服務。"""
+    state_machine.first_frame_event.wait()
+    if WEB_SERVER_PORT:
+        try:
+            from offload_manager import OffloadManager
+            from web_manager import WebManager, load_or_create_token
+            token = WEB_ACCESS_TOKEN or load_or_create_token(WEB_TOKEN_PATH)
+            offload_mgr = OffloadManager(save_dir, state_machine.thumbnail_mgr, allow_delete=OFFLOAD_ALLOW_DELETE)
+            state_machine.web_mgr = WebManager(save_dir, token, host=WEB_SERVER_HOST, port=WEB_SERVER_PORT, offload_mgr=offload_mgr)
+        except Exception as e:
+            logging.error(f"無法啟動 HTTP 服務: {e}")
+    try:
+        # 此時 picamera2 已由相機初始化載入，匯入編碼器不會拖慢開機
+        from video_manager import VideoManager
+        state_machine.video_mgr = VideoManager(cam_mgr, state_machine.thumbnail_mgr)
+    except Exception as e:
+        logging.error(f"無法初始化錄影功能: {e}")
+    if USE_ENCODE_WORKERS:
+        try:
+            from encode_manager import EncodeManager
+            state_machine.attach_encode_manager(EncodeManager(cam_mgr.get_still_frame_shape()))
+        except Exception as e:
+            logging.error(f"無法啟動編碼工作行程，改用執行緒保存: {e}")
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    # 初始化顯示器
+    # 編碼工作行程以 spawn 啟動時會重新載入本檔，硬體相關模組只在主行程匯入
+    from display_manager import DisplayManager
+    from key_manager import KeyManager
+
+    # 初始化顯示器，並立即顯示啟動畫面
     disp_mgr = DisplayManager()
     if disp_mgr.disp:
-        # 初始化電池管理器
-        battery_mgr = BatteryManager(update_interval=60)
+        disp_mgr.show_splash("Starting...")
+        logging.info(f"啟動畫面已顯示: {time.monotonic() - BOOT_START_TIME:.2f} 秒")
 
-        # 初始化相機管理器
-        cam_mgr = CameraManager(disp_mgr)
+        # 使用當前使用者的家目錄作為基礎
+        home_dir = os.path.expanduser("~")
+        # 建立儲存影像的路徑
+        save_dir = os.path.join(home_dir, "photo")
+        os.makedirs(save_dir, exist_ok=True)
 
-        if cam_mgr.initialize_camera():
+        # 相機、電池感測器與相簿目錄同時初始化
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            camera_future = executor.submit(timed_init, "相機", init_camera, disp_mgr)
+            battery_future = executor.submit(timed_init, "電池感測器", init_battery)
+            catalog_future = executor.submit(timed_init, "相簿", init_catalog, save_dir)
+            cam_mgr = camera_future.result()
+            battery_mgr = battery_future.result()
+            thumbnail_mgr = catalog_future.result()
+
+        if cam_mgr:
+            from state_machine import StateMachine
             key_mgr = KeyManager(disp_mgr.disp)
 
-            # 使用當前使用者的家目錄作為基礎
-            home_dir = os.path.expanduser("~")
-            # 建立儲存影像的路徑
-            save_dir = os.path.join(home_dir, "photo")
-            os.makedirs(save_dir, exist_ok=True)
+            writeback_mgr = None
+            if WRITEBACK_RAM_BUDGET_MB:
+                try:
+                    from writeback_manager import WriteBackManager
+                    writeback_mgr = WriteBackManager(ram_budget=WRITEBACK_RAM_BUDGET_MB * 1024 * 1024)
+                except Exception as e:
+                    logging.error(f"無法建立 RAM 暫存區，改為直接寫入: {e}")
+
+            job_mgr = None
+            if USE_JOB_QUEUE:
+                try:
+                    from job_queue_manager import JobQueueManager
+                    job_mgr = JobQueueManager(os.path.join(thumbnail_mgr.thumbnail_dir, "jobs.db"), battery_mgr, key_mgr)
+                except Exception as e:
+                    logging.error(f"無法建立背景工作佇列，改為拍攝後立即處理: {e}")
 
             # 初始化狀態機
-            state_machine = StateMachine(disp_mgr, cam_mgr, key_mgr, battery_mgr, save_dir)
+            state_machine = StateMachine(disp_mgr, cam_mgr, key_mgr, battery_mgr, save_dir,
+                                         thumbnail_mgr=thumbnail_mgr, boot_start_time=BOOT_START_TIME,
+                                         timelapse_interval=TIMELAPSE_INTERVAL, night_frames=NIGHT_FRAMES,
+                                         sharp_frames=SHARP_FRAMES, writeback_mgr=writeback_mgr,
+                                         job_mgr=job_mgr, preview_target_fps=PREVIEW_TARGET_FPS)
+            Thread(target=start_deferred_services, args=(state_machine, cam_mgr, save_dir), daemon=True).start()
 
             # 主循環 - 使用狀態機來處理相機流程
             try:
@@ -46,10 +155,28 @@ if __name__ == "__main__":
                 logging.info("程序被用戶中斷。")
             finally:
                 # 清理資源
+                if state_machine.video_mgr:
+                    if state_machine.video_mgr.recording:
+                        state_machine.video_mgr.stop_recording()
+                    # 寫入執行緒為 daemon，結束前等待影片寫完
+                    state_machine.video_mgr.wait_until_written()
+                if state_machine.web_mgr:
+                    state_machine.web_mgr.close()
+                if state_machine.encode_mgr:
+                    state_machine.encode_mgr.close()
+                if writeback_mgr:
+                    # 關閉前把 RAM 中的照片全部寫回 SD 卡
+                    writeback_mgr.close()
+                if job_mgr:
+                    # 寫回完成的回呼可能仍會排入工作，因此最後才關閉佇列
+                    job_mgr.close()
+                # 背景分析的結果延後寫回，結束前把尚未寫入的附加資訊存檔
+                state_machine.thumbnail_mgr.save_photo_metadata()
                 cam_mgr.close_camera()
                 disp_mgr.close_display()
                 logging.info("程序已安全退出。")
         else:
             logging.error("相機初始化失敗。")
+            disp_mgr.show_splash("Camera Error")
     else:
-        logging.error("顯示初始化失敗。")
\ No newline at end of file
+        logging.error("顯示初始化失敗。")
@@ -0,0 +1,106 @@
+# offload_client.py
+#
+# 批次匯出照片的參考客戶端，可在電腦上執行，也可在本機對 web_manager.py 測試:
+#   python3 offload_client.py http://<相機 IP>:8000 ./backup --token <權杖> [--delete]
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import urllib.request
+
+# 與 offload_manager.py 相同；本檔不匯入相機端模組，只需標準函式庫即可在電腦上執行
+SHA256_PAX_KEY = "PICAMERA.sha256"
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _get(url, token):
+    return urllib.request.urlopen(urllib.request.Request(url, headers={"X-Camera-Token": token}))
+
+def _post_json(url, data, token):
+    request = urllib.request.Request(url, data=json.dumps(data).encode("utf-8"),
+                                     headers={"Content-Type": "application/json", "X-Camera-Token": token})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+def _receive_batch(response, dest_dir):
+    """邊接收邊解開 tar 串流，逐檔驗證 SHA-256，回傳驗證成功的 [{"name", "sha256"}]。"""
+    verified = []
+    with tarfile.open(fileobj=response, mode="r|") as tar:
+        for member in tar:
+            name = os.path.basename(member.name)
+            if not member.isfile() or name != member.name:
+                continue
+            temp_path = os.path.join(dest_dir, "." + name + ".part")
+            digest = hashlib.sha256()
+            source = tar.extractfile(member)
+            with open(temp_path, "wb") as f:
+                for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            sha256 = digest.hexdigest()
+            if sha256 != member.pax_headers.get(SHA256_PAX_KEY):
+                logging.warning(f"雜湊不一致，下次重新傳送: {name}")
+                os.remove(temp_path)
+                continue
+            os.replace(temp_path, os.path.join(dest_dir, name))
+            os.utime(os.path.join(dest_dir, name), (member.mtime, member.mtime))
+            verified.append({"name": name, "sha256": sha256})
+    return verified
+
+def _acknowledge(base_url, files, delete, token):
+    result = _post_json(f"{base_url}/offload/ack", {"files": files, "delete": delete}, token)
+    if delete and not result.get("delete_allowed"):
+        logging.warning("相機端未允許刪除，檔案仍保留在相機上 (需在相機的 main.py 設定 OFFLOAD_ALLOW_DELETE)")
+    return result["acked"]
+
+def offload(base_url, dest_dir, token, delete=False, max_bytes=64 * 1024 * 1024):
+    os.makedirs(dest_dir, exist_ok=True)
+
+    # 上次中斷在確認之前時，本機已有且雜湊相符的檔案直接確認，不必重新下載
+    with _get(f"{base_url}/offload/manifest", token) as response:
+        manifest = json.load(response)["files"]
+    already_received = []
+    for entry in manifest:
+        local_path = os.path.join(dest_dir, entry["name"])
+        if not entry["acked"] and os.path.isfile(local_path) and os.path.getsize(local_path) == entry["size"] \
+                and hash_file(local_path) == entry["sha256"]:
+            already_received.append({"name": entry["name"], "sha256": entry["sha256"]})
+    if already_received:
+        _acknowledge(base_url, already_received, delete, token)
+        logging.info(f"本機已有 {len(already_received)} 個檔案，直接確認")
+
+    total_files = 0
+    while True:
+        with _get(f"{base_url}/offload/batch?max_bytes={max_bytes}", token) as response:
+            if response.status == 204:
+                break
+            verified = _receive_batch(response, dest_dir)
+        if not verified:
+            logging.error("這一批沒有任何檔案通過驗證，停止匯出")
+            break
+        acked = _acknowledge(base_url, verified, delete, token)
+        total_files += len(acked)
+        logging.info(f"已確認 {len(acked)} 個檔案 (累計 {total_files})")
+    logging.info(f"匯出完成，共 {total_files} 個檔案")
+    return total_files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="從相機批次匯出照片，可中斷後續傳")
+    parser.add_argument("base_url", help="相機的 HTTP 位址，例如 http://192.168.1.10:8000")
+    parser.add_argument("dest_dir", help="保存匯出照片的資料夾")
+    parser.add_argument("--token", required=True, help="相機的 HTTP 存取權杖 (相機上的 ~/.pi_camera/web_token)")
+    parser.add_argument("--delete", action="store_true", help="驗證成功後刪除相機上的檔案 (相機端需允許刪除)")
+    parser.add_argument("--max-mb", type=int, default=64, help="每一批的最大大小 (MB)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    offload(args.base_url.rstrip("/"), args.dest_dir, args.token, delete=args.delete, max_bytes=args.max_mb * 1024 * 1024)
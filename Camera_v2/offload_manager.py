@@ -0,0 +1,187 @@
+# offload_manager.py
+
+import hashlib
+import json
+import logging
+import os
+import tarfile
+from threading import Lock
+
+from thumbnail_manager import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+
+HASH_CHUNK_SIZE = 1024 * 1024
+SHA256_PAX_KEY = "PICAMERA.sha256"
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """以固定大小的區塊逐段計算 SHA-256，不會一次把整個檔案讀入記憶體。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class OffloadManager:
+    def __init__(self, save_dir, thumbnail_mgr=None, allow_delete=False):
+        """
+        批次匯出照片。維護保存目錄的清單 (大小、修改時間、SHA-256)，雜湊值快取在磁碟上，
+        只有新增或修改過的檔案才需要重新計算。
+        客戶端確認收到 (並驗證雜湊) 的檔案會被記錄下來，中斷後重新連線只會傳送尚未確認的檔案。
+        allow_delete 為 False (預設) 時，客戶端的刪除要求一律忽略，只記錄確認。
+        """
+        self.save_dir = save_dir
+        self.thumbnail_mgr = thumbnail_mgr
+        self.allow_delete = allow_delete
+        state_dir = thumbnail_mgr.thumbnail_dir if thumbnail_mgr else save_dir
+        self.manifest_path = os.path.join(state_dir, "offload_manifest.json")
+        self.acked_path = os.path.join(state_dir, "offload_acked.json")
+
+        self.lock = Lock()
+        self.manifest = self._load_json(self.manifest_path)  # 檔名 -> {"size", "mtime_ns", "sha256"}
+        self.acked = self._load_json(self.acked_path)  # 檔名 -> 已確認的 SHA-256
+
+    def _load_json(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.error(f"Failed to load offload state {path}: {e}")
+            return {}
+
+    def _save_json(self, path, data):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+
+    def build_manifest(self):
+        """掃描保存目錄並更新清單，回傳依檔名排序的 [{"name", "size", "mtime", "sha256", "acked"}]。"""
+        with self.lock:
+            manifest = {}
+            hashed = 0
+            with os.scandir(self.save_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                        continue
+                    stat = entry.stat()
+                    cached = self.manifest.get(entry.name)
+                    if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+                        manifest[entry.name] = cached
+                        continue
+                    try:
+                        manifest[entry.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hash_file(entry.path)}
+                        hashed += 1
+                    except OSError as e:
+                        logging.error(f"計算雜湊失敗: {entry.name}: {e}")
+
+            changed = hashed or manifest.keys() != self.manifest.keys()
+            self.manifest = manifest
+            if changed:
+                self._save_json(self.manifest_path, self.manifest)
+                logging.info(f"匯出清單已更新: {len(manifest)} 個檔案，重新計算雜湊 {hashed} 個")
+
+            return [{"name": name, "size": info["size"], "mtime": info["mtime_ns"] / 1e9, "sha256": info["sha256"],
+                     "acked": self.acked.get(name) == info["sha256"]}
+                    for name, info in sorted(manifest.items())]
+
+    def pending_files(self, max_bytes=None, max_files=None):
+        """依檔名順序回傳尚未確認的檔案，從上次確認的位置接續；可限制一批的總大小與數量。"""
+        batch = []
+        total_bytes = 0
+        for entry in self.build_manifest():
+            if entry["acked"]:
+                continue
+            if batch and ((max_bytes and total_bytes + entry["size"] > max_bytes) or (max_files and len(batch) >= max_files)):
+                break
+            batch.append(entry)
+            total_bytes += entry["size"]
+        return batch
+
+    def _tar_header(self, entry):
+        info = tarfile.TarInfo(entry["name"])
+        info.size = entry["size"]
+        info.mtime = int(entry["mtime"])
+        info.mode = 0o644
+        info.pax_headers = {SHA256_PAX_KEY: entry["sha256"]}
+        return info.tobuf(format=tarfile.PAX_FORMAT)
+
+    def tar_stream_size(self, batch):
+        """計算 tar 串流的總長度，讓回應可以帶 Content-Length，客戶端能偵測傳輸中斷。"""
+        size = 2 * tarfile.BLOCKSIZE
+        for entry in batch:
+            size += len(self._tar_header(entry)) + self._padded_size(entry["size"])
+        return size
+
+    def _padded_size(self, size):
+        return (size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+
+    def write_tar(self, connection, batch):
+        """
+        將一批檔案以 tar 串流寫入 socket。標頭以一般寫入送出，檔案內容使用 socket.sendfile，
+        在 Linux 上不經過使用者空間。每個檔案的 SHA-256 放在 PAX 標頭中供客戶端驗證。
+        """
+        sent_bytes = 0
+        for entry in batch:
+            path = os.path.join(self.save_dir, entry["name"])
+            connection.sendall(self._tar_header(entry))
+            with open(path, "rb") as f:
+                # 檔案在清單建立後被修改時，內容仍以清單中的大小送出，客戶端的雜湊驗證會失敗並於下次重傳
+                sent = connection.sendfile(f, 0, entry["size"])
+                if sent < entry["size"]:
+                    connection.sendall(bytes(entry["size"] - sent))
+            padding = self._padded_size(entry["size"]) - entry["size"]
+            if padding:
+                connection.sendall(bytes(padding))
+            sent_bytes += entry["size"]
+        connection.sendall(bytes(2 * tarfile.BLOCKSIZE))
+        logging.info(f"已送出匯出批次: {len(batch)} 個檔案，{sent_bytes / 1e6:.1f} MB")
+
+    def acknowledge(self, files, delete=False):
+        """
+        記錄客戶端已驗證的檔案 [{"name", "sha256"}]。雜湊與清單一致才會記錄；
+        delete 為 True 且相機端允許刪除時，同時刪除這些檔案以釋放空間。回傳已確認的檔名清單。
+        """
+        if delete and not self.allow_delete:
+            logging.warning("相機端未允許刪除，匯出確認只記錄不刪除")
+            delete = False
+        confirmed = []
+        deleted = []
+        with self.lock:
+            for item in files:
+                name, sha256 = item.get("name"), item.get("sha256")
+                info = self.manifest.get(name)
+                if info is None or info["sha256"] != sha256:
+                    logging.warning(f"匯出確認的雜湊不一致，略過: {name}")
+                    continue
+                self.acked[name] = sha256
+                confirmed.append(name)
+
+                if delete:
+                    path = os.path.join(self.save_dir, name)
+                    try:
+                        # 刪除前再確認一次檔案沒有被修改
+                        stat = os.stat(path)
+                        if stat.st_size == info["size"] and stat.st_mtime_ns == info["mtime_ns"]:
+                            os.remove(path)
+                            deleted.append(name)
+                    except OSError as e:
+                        logging.error(f"刪除已匯出的檔案失敗: {name}: {e}")
+
+            for name in deleted:
+                self.manifest.pop(name, None)
+                self.acked.pop(name, None)
+            self._save_json(self.acked_path, self.acked)
+            if deleted:
+                self._save_json(self.manifest_path, self.manifest)
+
+        if deleted:
+            logging.info(f"已刪除 {len(deleted)} 個已匯出的檔案")
+            if self.thumbnail_mgr:
+                for name in deleted:
+                    try:
+                        os.remove(self.thumbnail_mgr.get_thumbnail_path(os.path.join(self.save_dir, name)))
+                    except FileNotFoundError:
+                        pass
+                self.thumbnail_mgr.refresh_image_list()
+        return confirmed
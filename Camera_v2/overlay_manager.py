@@ -0,0 +1,80 @@
+# overlay_manager.py
+
+import time
+
+import cv2
+import numpy as np
+
+class OverlayManager:
+    def __init__(self, sample_width=160, histogram_interval=0.5, histogram_size=(64, 32), peaking_threshold=60,
+                 peaking_color=(255, 0, 0)):
+        """
+        預覽的曝光直方圖與對焦峰值 (focus peaking) 疊加層。
+        統計只在切片取樣後約 sample_width 寬的小影像上計算：峰值以 Sobel 邊緣強度每幀更新，
+        直方圖每 histogram_interval 秒以 bincount 更新一次並畫成快取的圖層。
+        顏色以螢幕的 RGB 順序表示。
+        """
+        self.sample_width = sample_width
+        self.histogram_interval = histogram_interval
+        self.histogram_width, self.histogram_height = histogram_size
+        self.peaking_threshold = peaking_threshold
+        self.peaking_color = np.array(peaking_color, dtype=np.uint8)
+
+        self.enabled = False
+        self.peaking_mask = None
+        self.histogram_layer = None  # 快取的直方圖圖層 (白色長條的遮罩)
+        self.last_histogram_time = 0
+        self.cost_ms = 0.0  # 每幀額外成本的平滑值，顯示在 FPS 旁
+        self.frame_cost = 0.0
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.peaking_mask = None
+        self.histogram_layer = None
+        self.last_histogram_time = 0
+        return self.enabled
+
+    def update(self, frame):
+        """由預覽迴圈對每個原始畫面呼叫，計算峰值遮罩並在需要時更新直方圖。"""
+        start_time = time.monotonic()
+        step = max(1, frame.shape[1] // self.sample_width)
+        small = np.ascontiguousarray(frame[::step, ::step, :3])
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+        # 邊緣強度 = |dx| + |dy|，在小影像上計算只需不到一毫秒
+        grad_x = cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_16S, 1, 0, ksize=3))
+        grad_y = cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_16S, 0, 1, ksize=3))
+        self.peaking_mask = cv2.add(grad_x, grad_y) > self.peaking_threshold
+
+        current_time = time.monotonic()
+        if current_time - self.last_histogram_time >= self.histogram_interval:
+            self.last_histogram_time = current_time
+            self.histogram_layer = self._render_histogram(gray)
+
+        self.frame_cost = time.monotonic() - start_time
+
+    def _render_histogram(self, gray):
+        counts = np.bincount(gray.ravel(), minlength=256)
+        # 256 階合併為圖層寬度的長條數
+        bins = counts.reshape(self.histogram_width, -1).sum(axis=1)
+        heights = (bins * self.histogram_height / max(bins.max(), 1)).astype(np.int32)
+        rows = np.arange(self.histogram_height)[:, None]
+        return rows >= self.histogram_height - heights[None, :]
+
+    def draw(self, image):
+        """把峰值與直方圖畫到已縮放至螢幕大小的影像上 (就地修改)。"""
+        start_time = time.monotonic()
+        if self.peaking_mask is not None:
+            mask = cv2.resize(self.peaking_mask.astype(np.uint8), (image.shape[1], image.shape[0]), interpolation=cv2.INTER_NEAREST)
+            image[mask > 0] = self.peaking_color
+
+        if self.histogram_layer is not None:
+            # 右下角：背景調暗後畫上白色長條
+            height, width = self.histogram_height, self.histogram_width
+            if image.shape[0] > height + 4 and image.shape[1] > width + 4:
+                region = image[-height - 2:-2, -width - 2:-2]
+                region //= 2
+                region[self.histogram_layer] = 255
+
+        cost = self.frame_cost + time.monotonic() - start_time
+        self.cost_ms += 0.1 * (cost * 1000 - self.cost_ms)
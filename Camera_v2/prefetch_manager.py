@@ -0,0 +1,114 @@
+# prefetch_manager.py
+
+import logging
+import os
+from collections import OrderedDict
+from threading import Condition, Thread
+
+import cv2
+
+class PrefetchManager:
+    def __init__(self, thumbnail_mgr, cache_size=32, placeholder_cache_size=512):
+        """
+        相簿的預先解碼。依捲動方向在背景解碼接下來會顯示的縮略圖；
+        每次排程都會取代尚未開始的工作，過時的預測直接取消。
+        快速捲動時以 1/8 解碼的小圖 (約 30x17) 作為低成本的預覽。
+        """
+        self.thumbnail_mgr = thumbnail_mgr
+        self.cache_size = cache_size
+        self.placeholder_cache_size = placeholder_cache_size
+
+        self.condition = Condition()
+        self.jobs = []  # 尚未開始的 (影像路徑, 是否解碼完整縮略圖)
+        self.thumbnail_cache = OrderedDict()
+        self.placeholder_cache = OrderedDict()
+        self.cancelled = 0
+        self.completed = 0
+        self.running = True
+        self.worker_thread = Thread(target=self._worker, daemon=True)
+        self.worker_thread.start()
+
+    def _cache_put(self, cache, max_size, image_path, image):
+        with self.condition:
+            cache[image_path] = image
+            cache.move_to_end(image_path)
+            if len(cache) > max_size:
+                cache.popitem(last=False)
+
+    def _cache_get(self, cache, image_path):
+        with self.condition:
+            image = cache.get(image_path)
+            if image is not None:
+                cache.move_to_end(image_path)
+            return image
+
+    def schedule(self, image_paths, full=True):
+        """排程預先解碼，依清單順序 (捲動方向由近到遠) 執行，未開始的舊工作全部取消。"""
+        cache = self.thumbnail_cache if full else self.placeholder_cache
+        with self.condition:
+            self.cancelled += len(self.jobs)
+            self.jobs = [(image_path, full) for image_path in image_paths if image_path not in cache]
+            self.condition.notify()
+
+    def _decode_placeholder(self, image_path):
+        # 只解碼已存在的縮略圖，不為了預覽去解碼原始照片
+        thumbnail_path = self.thumbnail_mgr.get_thumbnail_path(image_path)
+        if not os.path.exists(thumbnail_path):
+            return None
+        return cv2.imread(thumbnail_path, cv2.IMREAD_REDUCED_COLOR_8)
+
+    def get_placeholder(self, image_path):
+        """回傳低解析度預覽；沒有預先解碼時立即解碼 (成本很低)。"""
+        placeholder = self._cache_get(self.placeholder_cache, image_path)
+        if placeholder is None:
+            placeholder = self._decode_placeholder(image_path)
+            if placeholder is not None:
+                self._cache_put(self.placeholder_cache, self.placeholder_cache_size, image_path, placeholder)
+        return placeholder
+
+    def load_thumbnail(self, image_path):
+        """回傳完整縮略圖，已預先解碼時不需讀取檔案。"""
+        thumbnail = self._cache_get(self.thumbnail_cache, image_path)
+        if thumbnail is None:
+            thumbnail = self.thumbnail_mgr.load_or_generate_thumbnail(image_path)
+            if thumbnail is not None:
+                self._cache_put(self.thumbnail_cache, self.cache_size, image_path, thumbnail)
+        return thumbnail
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while self.running and not self.jobs:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                image_path, full = self.jobs.pop(0)
+
+            try:
+                if full:
+                    image = self.thumbnail_mgr.load_or_generate_thumbnail(image_path)
+                    cache, max_size = self.thumbnail_cache, self.cache_size
+                else:
+                    image = self._decode_placeholder(image_path)
+                    cache, max_size = self.placeholder_cache, self.placeholder_cache_size
+            except Exception as e:
+                logging.error(f"預先解碼失敗: {image_path}: {e}")
+                continue
+            if image is not None:
+                self._cache_put(cache, max_size, image_path, image)
+                with self.condition:
+                    self.completed += 1
+
+    def pop_stats(self):
+        """回傳並重設 (已完成, 已取消) 的預先解碼數。"""
+        with self.condition:
+            stats = (self.completed, self.cancelled)
+            self.completed = 0
+            self.cancelled = 0
+        return stats
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.jobs = []
+            self.condition.notify()
@@ -0,0 +1,66 @@
+# preview_quality_controller.py
+
+import logging
+
+import cv2
+
+# 預覽品質等級，由高到低。decimation 為縮放前的切片取樣間隔，hud_interval 為文字與電池圖案的重繪間隔 (幀)
+PREVIEW_QUALITY_LEVELS = [
+    {"name": "full", "interpolation": cv2.INTER_AREA, "decimation": 1, "hud_interval": 1, "show_fps": True},
+    {"name": "linear", "interpolation": cv2.INTER_LINEAR, "decimation": 1, "hud_interval": 2, "show_fps": True},
+    {"name": "decimate2", "interpolation": cv2.INTER_LINEAR, "decimation": 2, "hud_interval": 5, "show_fps": True},
+    {"name": "minimal", "interpolation": cv2.INTER_NEAREST, "decimation": 4, "hud_interval": 10, "show_fps": False},
+]
+
+class PreviewQualityController:
+    def __init__(self, target_fps=15, levels=PREVIEW_QUALITY_LEVELS, smoothing=0.2, degrade_frames=5, recover_frames=30):
+        """
+        預覽品質的回饋控制。以平滑後的每幀處理時間與目標比較：
+        連續 degrade_frames 幀超過目標時降低一級，連續 recover_frames 幀明顯低於目標時提高一級。
+        降級反應快、升級較慢，避免在兩個等級之間來回切換。
+        """
+        self.target_frame_time = 1.0 / target_fps
+        self.levels = levels
+        self.smoothing = smoothing
+        self.degrade_frames = degrade_frames
+        self.recover_frames = recover_frames
+
+        self.level = 0
+        self.average_frame_time = None
+        self.over_count = 0
+        self.under_count = 0
+
+    @property
+    def quality(self):
+        return self.levels[self.level]
+
+    def update(self, frame_time):
+        """記錄一幀的處理時間，必要時調整品質等級。"""
+        if self.average_frame_time is None:
+            self.average_frame_time = frame_time
+        else:
+            self.average_frame_time += self.smoothing * (frame_time - self.average_frame_time)
+
+        if self.average_frame_time > self.target_frame_time * 1.15:
+            self.over_count += 1
+            self.under_count = 0
+        elif self.average_frame_time < self.target_frame_time * 0.7:
+            self.under_count += 1
+            self.over_count = 0
+        else:
+            self.over_count = 0
+            self.under_count = 0
+
+        if self.over_count >= self.degrade_frames and self.level < len(self.levels) - 1:
+            self._set_level(self.level + 1)
+        elif self.under_count >= self.recover_frames and self.level > 0:
+            self._set_level(self.level - 1)
+
+    def _set_level(self, level):
+        logging.info(f"預覽品質 {self.levels[self.level]['name']} -> {self.levels[level]['name']}: "
+                     f"幀時間 {self.average_frame_time * 1000:.0f} ms (目標 {self.target_frame_time * 1000:.0f} ms)")
+        self.level = level
+        self.over_count = 0
+        self.under_count = 0
+        # 新等級的幀時間需要重新累積，避免舊的平均值立即觸發下一次調整
+        self.average_frame_time = None
@@ -0,0 +1,214 @@
+# pyramid_manager.py
+
+import json
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from threading import Lock, Thread
+
+import cv2
+import numpy as np
+
+class PyramidManager:
+    def __init__(self, thumbnail_dir, tile_size=240, max_photos=20, tile_cache_size=16, quality=90):
+        """
+        相簿放大檢視用的多解析度影像金字塔。第一次放大某張照片時才在背景完整解碼一次，
+        將每個解析度 (1:1、1/2、1/4 ...) 切成 tile_size 的小塊保存到磁碟；
+        之後平移或切換倍率只需讀取並解碼畫面內的 (最多 4 個) 小塊。
+        只保留最近使用的 max_photos 張照片的金字塔。
+        """
+        self.pyramid_dir = os.path.join(thumbnail_dir, "pyramid")
+        os.makedirs(self.pyramid_dir, exist_ok=True)
+        self.tile_size = tile_size
+        self.max_photos = max_photos
+        self.tile_cache_size = tile_cache_size
+        self.quality = quality
+
+        self.lock = Lock()
+        self.meta_cache = {}  # 影像路徑 -> 金字塔資訊 (產生中時也可取得各層尺寸)
+        self.ready_levels = {}  # 影像路徑 -> 已寫完的層
+        self.generating = set()
+        self.failed = {}  # 影像路徑 -> 產生失敗時照片的修改時間，照片未改變前不再重試
+        self.tile_cache = OrderedDict()  # (影像路徑, 層, tx, ty) -> 解碼後的小塊
+
+    def _photo_dir(self, image_path):
+        return os.path.join(self.pyramid_dir, os.path.basename(image_path))
+
+    def _tile_path(self, image_path, level, tx, ty):
+        return os.path.join(self._photo_dir(image_path), f"L{level}_{ty}_{tx}.jpg")
+
+    def get_meta(self, image_path):
+        """
+        回傳金字塔資訊 {"levels": [[寬, 高], ...]}；尚未產生時在背景開始產生並回傳 None。
+        照片在金字塔產生後被修改時會重新產生。產生失敗的照片在修改前不會重試，可用 is_failed 查詢。
+        """
+        with self.lock:
+            meta = self.meta_cache.get(image_path)
+            if meta is not None:
+                return meta
+            if image_path in self.generating:
+                return None
+        if self.is_failed(image_path):
+            return None
+
+        meta_path = os.path.join(self._photo_dir(image_path), "meta.json")
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta.get("source_mtime") == os.path.getmtime(image_path):
+                # 更新使用時間，供清除舊金字塔時參考
+                os.utime(meta_path)
+                with self.lock:
+                    self.meta_cache[image_path] = meta
+                    self.ready_levels[image_path] = set(range(len(meta["levels"])))
+                return meta
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"Failed to load pyramid info: {image_path}: {e}")
+
+        with self.lock:
+            if image_path not in self.generating:
+                self.generating.add(image_path)
+                Thread(target=self._generate, args=(image_path,), daemon=True).start()
+        return None
+
+    def is_failed(self, image_path):
+        """金字塔是否產生失敗且照片之後沒有被修改。"""
+        with self.lock:
+            if image_path not in self.failed:
+                return False
+            failed_mtime = self.failed[image_path]
+        try:
+            source_mtime = os.path.getmtime(image_path)
+        except OSError:
+            source_mtime = None
+        if source_mtime == failed_mtime:
+            return True
+        with self.lock:
+            self.failed.pop(image_path, None)
+        return False
+
+    def is_level_ready(self, image_path, level):
+        with self.lock:
+            return level in self.ready_levels.get(image_path, ())
+
+    def _generate(self, image_path):
+        start_time = time.monotonic()
+        photo_dir = self._photo_dir(image_path)
+        source_mtime = None
+        try:
+            source_mtime = os.path.getmtime(image_path)
+            image = cv2.imread(image_path)
+            if image is None:
+                raise ValueError("無法讀取照片")
+
+            # 先算出每一層的影像，再由最小的一層開始寫入，讓剛進入放大檢視時用到的層最先可用
+            levels = [image]
+            while max(levels[-1].shape[:2]) > self.tile_size * 2:
+                levels.append(cv2.resize(levels[-1], (levels[-1].shape[1] // 2, levels[-1].shape[0] // 2), interpolation=cv2.INTER_AREA))
+            meta = {"levels": [[level.shape[1], level.shape[0]] for level in levels], "source_mtime": source_mtime}
+
+            shutil.rmtree(photo_dir, ignore_errors=True)
+            os.makedirs(photo_dir)
+            with self.lock:
+                self.meta_cache[image_path] = meta
+                self.ready_levels[image_path] = set()
+                for key in [key for key in self.tile_cache if key[0] == image_path]:
+                    del self.tile_cache[key]
+
+            for level_index in reversed(range(len(levels))):
+                level = levels[level_index]
+                for y in range(0, level.shape[0], self.tile_size):
+                    for x in range(0, level.shape[1], self.tile_size):
+                        tile_path = self._tile_path(image_path, level_index, x // self.tile_size, y // self.tile_size)
+                        cv2.imwrite(tile_path, level[y:y + self.tile_size, x:x + self.tile_size], [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                with self.lock:
+                    self.ready_levels[image_path].add(level_index)
+
+            # meta.json 最後寫入，存在即代表金字塔完整
+            with open(os.path.join(photo_dir, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            logging.info(f"影像金字塔已產生: {os.path.basename(image_path)}, {len(levels)} 層, 耗時 {time.monotonic() - start_time:.2f} 秒")
+            self._evict_old_pyramids()
+        except Exception as e:
+            logging.error(f"Failed to generate pyramid: {image_path}: {e}")
+            shutil.rmtree(photo_dir, ignore_errors=True)
+            with self.lock:
+                self.meta_cache.pop(image_path, None)
+                self.ready_levels.pop(image_path, None)
+                self.failed[image_path] = source_mtime
+        finally:
+            with self.lock:
+                self.generating.discard(image_path)
+
+    def _evict_old_pyramids(self):
+        """只保留最近使用的金字塔，避免佔用過多 SD 卡空間。"""
+        entries = []
+        for name in os.listdir(self.pyramid_dir):
+            meta_path = os.path.join(self.pyramid_dir, name, "meta.json")
+            if os.path.exists(meta_path):
+                entries.append((os.path.getmtime(meta_path), name))
+        entries.sort(reverse=True)
+        for _, name in entries[self.max_photos:]:
+            shutil.rmtree(os.path.join(self.pyramid_dir, name), ignore_errors=True)
+            with self.lock:
+                for image_path in [path for path in self.meta_cache if os.path.basename(path) == name]:
+                    del self.meta_cache[image_path]
+                    self.ready_levels.pop(image_path, None)
+
+    def _load_tile(self, image_path, level, tx, ty):
+        key = (image_path, level, tx, ty)
+        with self.lock:
+            tile = self.tile_cache.get(key)
+            if tile is not None:
+                self.tile_cache.move_to_end(key)
+                return tile
+
+        tile = cv2.imread(self._tile_path(image_path, level, tx, ty))
+        if tile is None:
+            return None
+        with self.lock:
+            self.tile_cache[key] = tile
+            if len(self.tile_cache) > self.tile_cache_size:
+                self.tile_cache.popitem(last=False)
+        return tile
+
+    def viewport_origin(self, meta, level, center_x, center_y, view_size=240):
+        """依正規化的中心點 (0~1) 計算畫面左上角在該層的座標；該層比畫面小時置中。"""
+        width, height = meta["levels"][level]
+        x0 = (width - view_size) // 2 if width <= view_size else int(min(max(center_x * width - view_size / 2, 0), width - view_size))
+        y0 = (height - view_size) // 2 if height <= view_size else int(min(max(center_y * height - view_size / 2, 0), height - view_size))
+        return x0, y0
+
+    def render(self, image_path, meta, level, center_x, center_y, thumbnail=None, view_size=240):
+        """
+        組合指定層與中心點的 view_size x view_size 畫面 (BGR)。
+        該層尚未產生完成時，以縮略圖放大代替，畫面會較模糊。
+        """
+        width, height = meta["levels"][level]
+        x0, y0 = self.viewport_origin(meta, level, center_x, center_y, view_size)
+
+        if not self.is_level_ready(image_path, level):
+            if thumbnail is None:
+                return None
+            scale = width / thumbnail.shape[1]
+            matrix = np.float32([[scale, 0, -x0], [0, scale, -y0]])
+            return cv2.warpAffine(thumbnail, matrix, (view_size, view_size), flags=cv2.INTER_LINEAR)
+
+        canvas = np.zeros((view_size, view_size, 3), dtype=np.uint8)
+        x_start, x_end = max(x0, 0), min(x0 + view_size, width)
+        y_start, y_end = max(y0, 0), min(y0 + view_size, height)
+        for ty in range(y_start // self.tile_size, (y_end - 1) // self.tile_size + 1):
+            for tx in range(x_start // self.tile_size, (x_end - 1) // self.tile_size + 1):
+                tile = self._load_tile(image_path, level, tx, ty)
+                if tile is None:
+                    continue
+                # 小塊與畫面範圍的交集
+                tile_x, tile_y = tx * self.tile_size, ty * self.tile_size
+                left, right = max(tile_x, x_start), min(tile_x + tile.shape[1], x_end)
+                top, bottom = max(tile_y, y_start), min(tile_y + tile.shape[0], y_end)
+                canvas[top - y0:bottom - y0, left - x0:right - x0] = tile[top - tile_y:bottom - tile_y, left - tile_x:right - tile_x]
+        return canvas
@@ -1,5 +1,27 @@
+import argparse
+import logging
 from pprint import *
 from picamera2 import Picamera2
+from sensor_autotuner import SensorAutotuner, format_results_table, get_profile_path, load_sensor_profile, save_sensor_profile
+
+parser = argparse.ArgumentParser(description="列出感測器模式並顯示或重新執行感測器模式調校")
+parser.add_argument("--autotune", action="store_true", help="重新量測所有感測器模式並更新設定檔 (需先停止相機程式)")
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 picam2 = Picamera2()
 pprint(picam2.sensor_modes)
+
+if args.autotune:
+    profile = SensorAutotuner(picam2).run()
+    save_sensor_profile(picam2, profile)
+else:
+    profile = load_sensor_profile(picam2)
+
+print()
+if profile:
+    print(format_results_table(profile))
+else:
+    print(f"尚未調校 ({get_profile_path(picam2)} 不存在或格式錯誤)，可執行 python3 resolution.py --autotune")
+picam2.close()
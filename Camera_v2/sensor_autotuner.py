@@ -0,0 +1,203 @@
+# sensor_autotuner.py
+
+import json
+import logging
+import os
+import time
+
+PROFILE_VERSION = 1
+PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".pi_camera")
+# 預覽主串流的候選寬度，高度依感測器模式的比例計算；None 表示 Picamera2 的預設大小
+PREVIEW_STREAM_WIDTHS = (None, 640)
+
+def _mode_key(mode):
+    return f"{mode['size'][0]}x{mode['size'][1]}/{mode['bit_depth']}"
+
+def _stream_size(mode, width):
+    if width is None:
+        return None
+    height = int(width * mode['size'][1] / mode['size'][0]) // 2 * 2
+    return (width, height)
+
+def find_sensor_mode(picam2, key):
+    """依 "寬x高/位元深度" 找回對應的感測器模式，找不到時回傳 None。"""
+    for mode in picam2.sensor_modes:
+        if _mode_key(mode) == key:
+            return mode
+    return None
+
+def get_profile_path(picam2):
+    model = picam2.camera_properties.get("Model", "unknown")
+    return os.path.join(PROFILE_DIR, f"sensor_profile_{model}.json")
+
+def _is_valid_profile(profile):
+    """檢查設定檔的結構，避免手動修改或寫到一半的檔案在初始化相機時拋出例外。"""
+    try:
+        preview, still, results = profile["preview"], profile["still"], profile["results"]
+        if not isinstance(preview["mode"], str) or not isinstance(preview["stream"], str) or not isinstance(still["mode"], str):
+            return False
+        stream_size = preview["stream_size"]
+        if stream_size is not None and (len(stream_size) != 2 or not all(isinstance(value, int) and value > 0 for value in stream_size)):
+            return False
+        return isinstance(results["preview"], list) and isinstance(results["still"], list)
+    except (KeyError, TypeError):
+        return False
+
+def load_sensor_profile(picam2):
+    """讀取此感測器的設定檔；不存在、版本不符、格式錯誤或模式已不存在時回傳 None。"""
+    profile_path = get_profile_path(picam2)
+    try:
+        with open(profile_path, "r") as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error(f"Failed to load sensor profile: {e}")
+        return None
+
+    if not isinstance(profile, dict) or profile.get("version") != PROFILE_VERSION:
+        return None
+    if not _is_valid_profile(profile):
+        logging.warning(f"感測器設定檔格式錯誤，視為沒有設定檔: {profile_path}")
+        return None
+    if find_sensor_mode(picam2, profile["preview"]["mode"]) is None or find_sensor_mode(picam2, profile["still"]["mode"]) is None:
+        logging.warning("設定檔中的感測器模式已不存在，需要重新調校")
+        return None
+    return profile
+
+def save_sensor_profile(picam2, profile):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_path = get_profile_path(picam2)
+    temp_path = profile_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(temp_path, profile_path)
+    logging.info(f"感測器設定檔已保存: {profile_path}")
+
+def format_results_table(profile):
+    """把調校結果整理成文字表格，標示目前選用的組合。"""
+    lines = [f"Sensor: {profile['sensor']}  (tuned {profile['created']})", "",
+             f"{'PREVIEW':<10}{'mode':<15} {'stream':<11} {'FPS':>6}  {'CPU%':>6}"]
+    for row in profile["results"]["preview"]:
+        chosen = "*" if row["mode"] == profile["preview"]["mode"] and row["stream"] == profile["preview"]["stream"] else " "
+        lines.append(f"{chosen}         {row['mode']:<15} {row['stream']:<11} {row['fps']:>6.1f}  {row['cpu']:>6.1f}")
+    lines += ["", f"{'STILL':<10}{'mode':<15} {'MP':>5}   {'switch(s)':>8}  {'capture(s)':>9}"]
+    for row in profile["results"]["still"]:
+        chosen = "*" if row["mode"] == profile["still"]["mode"] else " "
+        lines.append(f"{chosen}         {row['mode']:<15} {row['megapixels']:>5.1f}   {row['switch_s']:>8.2f}  {row['capture_s']:>9.2f}")
+    return "\n".join(lines)
+
+class SensorAutotuner:
+    def __init__(self, picam2, preview_frames=30, warmup_frames=5):
+        """
+        感測器模式調校：逐一量測每個感測器模式與預覽串流大小的實際預覽 FPS 與 CPU 負載，
+        以及每個模式作為拍攝模式時的切換時間與擷取延遲，選出最佳組合並寫入設定檔。
+        需在相機尚未開始串流時執行。
+        """
+        self.picam2 = picam2
+        self.preview_frames = preview_frames
+        self.warmup_frames = warmup_frames
+
+    def _create_preview_config(self, mode, stream_size):
+        main = {"size": stream_size} if stream_size else {}
+        return self.picam2.create_video_configuration(main=main, sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']},
+                                                      queue=False)
+
+    def _benchmark_preview(self, mode, stream_size):
+        """以與預覽迴圈相同的方式擷取畫面，回傳 (FPS, CPU%)。"""
+        self.picam2.configure(self._create_preview_config(mode, stream_size))
+        self.picam2.start()
+        try:
+            for _ in range(self.warmup_frames):
+                self.picam2.capture_request().release()
+
+            start_time = time.monotonic()
+            start_cpu = time.process_time()
+            for _ in range(self.preview_frames):
+                request = self.picam2.capture_request()
+                try:
+                    request.make_array("main")
+                finally:
+                    request.release()
+            elapsed = time.monotonic() - start_time
+            cpu = (time.process_time() - start_cpu) / elapsed * 100
+        finally:
+            self.picam2.stop()
+        return self.preview_frames / elapsed, cpu
+
+    def _benchmark_still(self, preview_config, mode):
+        """從預覽切換到拍攝模式、擷取一張再切回預覽，回傳 (切換時間, 擷取時間)。"""
+        still_config = self.picam2.create_still_configuration(sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']})
+        self.picam2.configure(preview_config)
+        self.picam2.start()
+        try:
+            for _ in range(self.warmup_frames):
+                self.picam2.capture_request().release()
+
+            start_time = time.monotonic()
+            self.picam2.switch_mode(still_config)
+            switch_time = time.monotonic() - start_time
+
+            start_time = time.monotonic()
+            self.picam2.capture_array()
+            capture_time = time.monotonic() - start_time
+
+            start_time = time.monotonic()
+            self.picam2.switch_mode(preview_config)
+            switch_time += time.monotonic() - start_time
+        finally:
+            self.picam2.stop()
+        return switch_time, capture_time
+
+    def run(self):
+        """執行調校並回傳設定檔 (尚未保存)。"""
+        start_time = time.monotonic()
+        modes = self.picam2.sensor_modes
+
+        preview_results = []
+        for mode in modes:
+            for width in PREVIEW_STREAM_WIDTHS:
+                stream_size = _stream_size(mode, width)
+                try:
+                    fps, cpu = self._benchmark_preview(mode, stream_size)
+                except Exception as e:
+                    logging.error(f"量測預覽模式失敗 {_mode_key(mode)}: {e}")
+                    continue
+                row = {"mode": _mode_key(mode), "stream": f"{stream_size[0]}x{stream_size[1]}" if stream_size else "default",
+                       "stream_size": stream_size, "fps": round(fps, 1), "cpu": round(cpu, 1)}
+                preview_results.append(row)
+                logging.info(f"預覽 {row['mode']} {row['stream']}: {fps:.1f} FPS, CPU {cpu:.0f}%")
+        if not preview_results:
+            raise RuntimeError("沒有可用的預覽模式")
+
+        # FPS 在最佳值 90% 以內的組合中，選 CPU 負載最低的
+        best_fps = max(row["fps"] for row in preview_results)
+        preview = min((row for row in preview_results if row["fps"] >= best_fps * 0.9), key=lambda row: row["cpu"])
+        preview_config = self._create_preview_config(find_sensor_mode(self.picam2, preview["mode"]), preview["stream_size"])
+
+        still_results = []
+        for mode in modes:
+            try:
+                switch_time, capture_time = self._benchmark_still(preview_config, mode)
+            except Exception as e:
+                logging.error(f"量測拍攝模式失敗 {_mode_key(mode)}: {e}")
+                continue
+            row = {"mode": _mode_key(mode), "megapixels": round(mode['size'][0] * mode['size'][1] / 1e6, 1),
+                   "switch_s": round(switch_time, 2), "capture_s": round(capture_time, 2)}
+            still_results.append(row)
+            logging.info(f"拍攝 {row['mode']}: 切換 {switch_time:.2f} 秒, 擷取 {capture_time:.2f} 秒")
+        if not still_results:
+            raise RuntimeError("沒有可用的拍攝模式")
+
+        # 拍攝以解析度優先，相同解析度時選快門延遲較短的
+        still = max(still_results, key=lambda row: (row["megapixels"], -(row["switch_s"] + row["capture_s"])))
+
+        logging.info(f"感測器調校完成，耗時 {time.monotonic() - start_time:.1f} 秒: 預覽 {preview['mode']} {preview['stream']}, 拍攝 {still['mode']}")
+        return {
+            "version": PROFILE_VERSION,
+            "sensor": self.picam2.camera_properties.get("Model", "unknown"),
+            "created": time.strftime("%Y/%m/%d %H:%M:%S"),
+            "preview": {"mode": preview["mode"], "stream": preview["stream"], "stream_size": preview["stream_size"]},
+            "still": {"mode": still["mode"]},
+            "results": {"preview": preview_results, "still": still_results},
+        }
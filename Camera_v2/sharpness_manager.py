@@ -0,0 +1,51 @@
+# sharpness_manager.py
+
+import logging
+import time
+
+import cv2
+import numpy as np
+
+def score_sharpness(image, target_width=576):
+    """
+    以拉普拉斯變異數評估清晰度。先以區域平均 (INTER_AREA) 縮小到 target_width 寬的灰階影像，
+    讓不同解析度與不同解碼方式 (完整解碼或縮小解碼) 的分數在同一個尺度上，可以用同一個門檻比較。
+    """
+    height, width = image.shape[:2]
+    if width != target_width:
+        new_size = (target_width, max(1, round(height * target_width / width)))
+        small = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA if width > target_width else cv2.INTER_LINEAR)
+    else:
+        small = np.ascontiguousarray(image)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    laplacian = cv2.Laplacian(small, cv2.CV_16S)
+    _, stddev = cv2.meanStdDev(laplacian)
+    return float(stddev[0][0] ** 2)
+
+class SharpestFrameSelector:
+    def __init__(self):
+        """
+        連拍時逐張評分，只保留目前最清晰的一張，可直接作為 CameraManager.capture_burst 的回呼。
+        """
+        self.best_image = None
+        self.best_score = None
+        self.best_index = None
+        self.scores = []
+
+    def add(self, image, index=None):
+        start_time = time.monotonic()
+        score = score_sharpness(image)
+        self.scores.append(score)
+        logging.info(f"第 {len(self.scores)} 張清晰度 {score:.1f} (評分 {(time.monotonic() - start_time) * 1000:.0f} ms)")
+        if self.best_score is None or score > self.best_score:
+            self.best_image = image
+            self.best_score = score
+            self.best_index = len(self.scores) - 1
+
+    def result(self):
+        """回傳 (最清晰的影像, 分數)；沒有影像時回傳 (None, None)。"""
+        if self.best_image is not None:
+            logging.info(f"選擇第 {self.best_index + 1} 張 (清晰度 {self.best_score:.1f})，各張分數: "
+                         + ", ".join(f"{score:.1f}" for score in self.scores))
+        return self.best_image, self.best_score
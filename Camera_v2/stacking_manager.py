@@ -0,0 +1,83 @@
+# stacking_manager.py
+
+import logging
+import time
+
+import cv2
+import numpy as np
+from latency_tracker import LatencyTracker
+
+class StackingManager:
+    def __init__(self, align_scale=8, max_shift=0.05, min_response=0.05):
+        """
+        多張影像的串流式疊加降噪。每張影像在縮小的灰階版本上估算位移，
+        對齊後累加到單一的 uint16 緩衝區，記憶體用量與張數無關。
+        max_shift 為允許的最大位移 (佔影像寬度的比例)，超過時視為晃動過大而略過該張。
+        """
+        self.align_scale = align_scale
+        self.max_shift = max_shift
+        self.min_response = min_response
+
+        self.accumulator = None  # uint16 累加緩衝區，最多可累加 257 張 8-bit 影像
+        self.aligned = None  # 對齊用的暫存影像，每張重複使用
+        self.reference = None
+        self.window = None
+        self.count = 0
+        self.skipped = 0
+        self.frame_time = LatencyTracker("夜景合成每幀處理", report_interval=0)
+
+    def _alignment_image(self, frame):
+        # 以切片取樣取代整張縮放，只需處理 1/(scale^2) 的像素
+        small = np.ascontiguousarray(frame[::self.align_scale, ::self.align_scale])
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        return gray.astype(np.float32)
+
+    def add(self, frame, index=None):
+        """加入一張影像，可直接作為 CameraManager.capture_burst 的回呼。"""
+        start_time = time.monotonic()
+
+        if self.accumulator is None:
+            self.accumulator = np.zeros(frame.shape, dtype=np.uint16)
+            self.aligned = np.empty_like(frame)
+            self.reference = self._alignment_image(frame)
+            self.window = cv2.createHanningWindow(self.reference.shape[::-1], cv2.CV_32F)
+            cv2.add(self.accumulator, frame, dst=self.accumulator, dtype=cv2.CV_16U)
+            self.count = 1
+            self.frame_time.add(time.monotonic() - start_time)
+            return True
+
+        if self.count >= 257:
+            logging.warning("累加張數已達 uint16 上限，略過")
+            return False
+
+        (dx, dy), response = cv2.phaseCorrelate(self.reference, self._alignment_image(frame), self.window)
+        dx *= self.align_scale
+        dy *= self.align_scale
+        if response < self.min_response or max(abs(dx), abs(dy)) > self.max_shift * frame.shape[1]:
+            self.skipped += 1
+            logging.warning(f"第 {self.count + self.skipped} 張位移過大或對齊失敗 ({dx:.1f}, {dy:.1f})，略過")
+            return False
+
+        if abs(dx) < 0.5 and abs(dy) < 0.5:
+            source = frame
+        else:
+            # 平移回參考影像的位置，結果寫入重複使用的暫存區
+            matrix = np.float32([[1, 0, -dx], [0, 1, -dy]])
+            cv2.warpAffine(frame, matrix, (frame.shape[1], frame.shape[0]), dst=self.aligned, borderMode=cv2.BORDER_REPLICATE)
+            source = self.aligned
+
+        cv2.add(self.accumulator, source, dst=self.accumulator, dtype=cv2.CV_16U)
+        self.count += 1
+
+        elapsed = time.monotonic() - start_time
+        self.frame_time.add(elapsed)
+        logging.info(f"夜景合成: 第 {self.count} 張, 位移 ({dx:.1f}, {dy:.1f}), 處理 {elapsed * 1000:.0f} ms")
+        return True
+
+    def result(self):
+        """回傳平均後的 8-bit 影像；沒有任何影像時回傳 None。"""
+        if self.count == 0:
+            return None
+        merged = cv2.convertScaleAbs(self.accumulator, alpha=1.0 / self.count)
+        logging.info(f"夜景合成完成: 使用 {self.count} 張, 略過 {self.skipped} 張。{self.frame_time.format_stats()}")
+        return merged
@@ -5,29 +5,128 @@ import os
 import cv2
 from enum import Enum
 import time
-from threading import Thread
-from thumbnail_manager import ThumbnailManager
-from libcamera import controls
-from picamera2 import Picamera2, Preview
+from threading import Event, Thread
+from thumbnail_manager import ThumbnailManager, read_jpeg_size, resize_to_fit, write_thumbnail
+from gallery_grid_manager import GalleryGridManager
+from pyramid_manager import PyramidManager
+from prefetch_manager import PrefetchManager
+from preview_quality_controller import PreviewQualityController
+from overlay_manager import OverlayManager
+from writeback_manager import write_jpeg
+from timelapse_manager import TimelapseManager
+from stacking_manager import StackingManager
+from sharpness_manager import SharpestFrameSelector, score_sharpness
 
 class State(Enum):
     PREVIEW = 1
     VIEW_IMAGE = 2
     CAPTURE = 3
+    TIMELAPSE = 4
+    VIDEO = 5
+    GRID = 6
+    ZOOM = 7
+
+class CaptureMode(Enum):
+    NORMAL = 1
+    NIGHT = 2
+    SHARP = 3
+
+# 預覽畫面左下角顯示的拍攝模式名稱
+CAPTURE_MODE_LABELS = {
+    CaptureMode.NORMAL: "Capture",
+    CaptureMode.NIGHT: "Night",
+    CaptureMode.SHARP: "Sharp",
+}
 
 class StateMachine:
-    def __init__(self, display_mgr, cam_mgr, key_mgr, battery_mgr, save_dir):
+    def __init__(self, display_mgr, cam_mgr, key_mgr, battery_mgr, save_dir, encode_mgr=None, thumbnail_mgr=None, boot_start_time=None, web_mgr=None, timelapse_interval=10, video_mgr=None, night_frames=8, sharp_frames=5, blur_threshold=60, writeback_mgr=None, job_mgr=None, preview_target_fps=15):
         self.display_mgr = display_mgr
         self.camera_mgr = cam_mgr
         self.key_mgr = key_mgr
         self.battery_mgr = battery_mgr
         self.state = State.PREVIEW
-        self.thumbnail_mgr = ThumbnailManager(save_dir, os.path.join(save_dir, "thumbnails"))
-        self.thumbnail_mgr.preload_thumbnails()
+        # 相簿可由外部預先掃描，縮略圖補齊延後到第一個預覽畫面之後
+        self.thumbnail_mgr = thumbnail_mgr or ThumbnailManager(save_dir, os.path.join(save_dir, "thumbnails"))
         self.image_index = None
+        self.capture_mode = CaptureMode.NORMAL
+        # 背景存檔或縮略圖補齊佔用 CPU 時，自動降低預覽品質以維持幀率
+        self.preview_quality = PreviewQualityController(target_fps=preview_target_fps)
+        # 預覽中以上鍵開關直方圖與對焦峰值
+        self.overlay_mgr = OverlayManager()
+        self.night_frames = night_frames  # 夜景模式疊加的張數
+        self.sharp_frames = sharp_frames  # 清晰優先模式連拍的張數
+        self.blur_threshold = blur_threshold  # 清晰度低於此值時在相簿中標示為模糊
+
+        # 相簿格狀檢視，只在畫面內容改變時重繪並傳送有變化的列
+        self.grid_mgr = GalleryGridManager(self.thumbnail_mgr)
+        self.grid_top_row = 0
+        self.grid_frame = None  # 上一次送到螢幕的格狀畫面
+        self.grid_view = None  # (選取位置, 第一列, 照片數)，未改變時不重繪
+
+        # 相簿放大檢視，由磁碟上的影像金字塔提供畫面內的小塊
+        self.pyramid_mgr = PyramidManager(self.thumbnail_mgr.thumbnail_dir)
+        self.zoom_path = None
+        self.zoom_level = None
+        self.zoom_center = (0.5, 0.5)  # 正規化的畫面中心 (0~1)
+        self.zoom_frame = None
+        self.zoom_view = None
+        self.view_notice = None  # (文字, 到期時間)，在單張檢視的狀態文字後短暫顯示
+
+        # 相簿捲動的預先解碼與按住加速
+        self.prefetch_mgr = PrefetchManager(self.thumbnail_mgr)
+        self.prefetch_index = None
+        self.scroll_direction = -1  # 進入相簿時由最新一張往前瀏覽
+        self.scroll_settled = True
+
+        # 縮時攝影，等待期間關閉相機與背光
+        self.timelapse_mgr = TimelapseManager(save_dir, battery_mgr, interval=timelapse_interval)
+        self.timelapse_backlight_off_time = None
+
+        # 可選的錄影管理器，載入 picamera2 編碼器後由外部掛上
+        self.video_mgr = video_mgr
+
+        # 開機計時，用於統計到第一個預覽畫面的時間
+        self.boot_start_time = boot_start_time
+        self.first_frame_event = Event()
+
+        # 可選的本地 HTTP 服務，與預覽共用同一份畫面
+        self.web_mgr = web_mgr
+
+        # 可選的 RAM 暫存寫回層，照片在寫回 SD 卡並 fsync 後才視為已保存
+        self.writeback_mgr = writeback_mgr
+
+        # 可選的持久化背景工作佇列：縮略圖、相簿更新與影像分析延後到閒置時執行
+        self.job_mgr = job_mgr
+        if self.job_mgr:
+            self.thumbnail_mgr.job_mgr = self.job_mgr
+            self.job_mgr.register_handler("thumbnail", lambda key, payload: self.thumbnail_mgr.load_or_generate_thumbnail(key))
+            self.job_mgr.register_handler("analyze", self._analyze_photo)
+            self.job_mgr.register_handler("metadata", lambda key, payload: self.thumbnail_mgr.set_photo_metadata(key, save=False, **payload))
+            self.job_mgr.register_handler("save_metadata", lambda key, payload: self.thumbnail_mgr.save_photo_metadata())
+            self.job_mgr.register_handler("catalog", lambda key, payload: self.thumbnail_mgr.refresh_image_list())
+
+        # 可選的多行程編碼器，保存完成後更新影像清單
+        self.encode_mgr = None
+        if encode_mgr:
+            self.attach_encode_manager(encode_mgr)
+
+    def attach_encode_manager(self, encode_mgr):
+        """掛上多行程編碼器，之後的拍攝改由工作行程保存。"""
+        encode_mgr.on_saved = self._on_image_saved
+        self.encode_mgr = encode_mgr
+
+    def _on_first_frame(self):
+        """第一個預覽畫面顯示後，回報開機時間並開始背景工作。"""
+        if self.boot_start_time is not None:
+            logging.info(f"開機至第一個預覽畫面耗時: {time.monotonic() - self.boot_start_time:.2f} 秒")
+        self.first_frame_event.set()
+        self.thumbnail_mgr.preload_thumbnails()
+        if self.job_mgr:
+            self.job_mgr.start()
 
     def handle_preview_state(self):
-        raw_image = self.camera_mgr.picam2.capture_array()
+        frame_start_time = time.monotonic()
+        raw_image = self.camera_mgr.capture_preview_frame()
 
         if raw_image is None or raw_image.size == 0:
             logging.error("預覽模式下捕捉到無效影像")
@@ -38,47 +137,330 @@ class StateMachine:
         current_time = time.strftime("%H:%M:%S")
         current_date = time.strftime("%Y/%m/%d")
 
-        self.display_mgr.display_image_with_state(raw_image, "Capture", date_text=current_date, time_text=current_time, battery_percentage=battery_percentage)
+        state_text = CAPTURE_MODE_LABELS[self.capture_mode]
+        if self.camera_mgr.focus_locked:
+            state_text += " AF-L"
+        state_text += self._job_progress_text()
+        overlay = None
+        if self.overlay_mgr.enabled:
+            self.overlay_mgr.update(raw_image)
+            overlay = self.overlay_mgr
+        self.display_mgr.display_image_with_state(raw_image, state_text, date_text=current_date, time_text=current_time,
+                                                  battery_percentage=battery_percentage, quality=self.preview_quality.quality,
+                                                  overlay=overlay)
+        self.camera_mgr.record_display_latency()
+
+        if self.web_mgr:
+            self.web_mgr.publish_frame(raw_image)
+        self.preview_quality.update(time.monotonic() - frame_start_time)
+
+        if not self.first_frame_event.is_set():
+            self._on_first_frame()
 
         if self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY1_PIN):
             self.state = State.CAPTURE
 
+        elif self.web_mgr and self.web_mgr.consume_capture_request():
+            self.state = State.CAPTURE
+
+        elif self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_PRESS_PIN):
+            # 半按快門：切換對焦與曝光鎖定
+            if self.camera_mgr.focus_locked:
+                self.camera_mgr.unlock_focus_exposure()
+            else:
+                self.camera_mgr.lock_focus_exposure()
+
         elif self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_LEFT_PIN):
             self.state = State.VIEW_IMAGE
             self.image_index = len(self.thumbnail_mgr.image_paths) - 1
 
+        elif self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_DOWN_PIN):
+            self._enter_timelapse()
+
+        elif self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_UP_PIN):
+            enabled = self.overlay_mgr.toggle()
+            logging.info(f"直方圖與對焦峰值{'開啟' if enabled else '關閉'}")
+
+        elif self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_RIGHT_PIN):
+            # 循環切換拍攝模式
+            modes = list(CaptureMode)
+            self.capture_mode = modes[(modes.index(self.capture_mode) + 1) % len(modes)]
+            logging.info(f"拍攝模式: {self.capture_mode.name}")
+
+        elif self.video_mgr and self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY2_PIN):
+            if self.video_mgr.start_recording():
+                if self.job_mgr:
+                    self.job_mgr.pause()
+                self.state = State.VIDEO
+
+    def handle_video_state(self):
+        video_mgr = self.video_mgr
+
+        if self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY2_PIN):
+            # 影片在背景寫完並關閉後才加入相簿
+            video_mgr.stop_recording(on_saved=self._on_image_saved)
+            if self.job_mgr:
+                self.job_mgr.resume()
+            self.state = State.PREVIEW
+            return
+
+        # 預覽降低更新頻率，其餘時間讓給編碼器
+        if not video_mgr.preview_due():
+            time.sleep(0.01)
+            return
+
+        video_mgr.maybe_report()
+        frame = video_mgr.capture_preview_frame()
+        if frame is None:
+            return
+
+        elapsed = int(video_mgr.elapsed())
+        stats = video_mgr.get_stats()
+        state_text = f"REC {elapsed // 60:02d}:{elapsed % 60:02d}"
+        if stats and stats["dropped_frames"]:
+            state_text += f" -{stats['dropped_frames']}"
+
+        battery_percentage = self.battery_mgr.get_battery_percentage()
+        self.display_mgr.display_image_with_state(frame, state_text, date_text=time.strftime("%Y/%m/%d"),
+                                                  time_text=time.strftime("%H:%M:%S"), battery_percentage=battery_percentage)
+
+    def _enter_timelapse(self):
+        if self.job_mgr:
+            self.job_mgr.pause()
+        self.timelapse_mgr.start()
+        self.camera_mgr.suspend()
+        self._show_timelapse_status()
+        self.state = State.TIMELAPSE
+
+    def _show_timelapse_status(self, duration=3):
+        """短暫點亮背光顯示縮時狀態，之後自動關閉。"""
+        frames_left = self.timelapse_mgr.estimate_frames_left()
+        status = f"TL {self.timelapse_mgr.interval}s: {self.timelapse_mgr.frames_saved}"
+        if frames_left is not None:
+            status += f" (~{frames_left})"
+        self.display_mgr.set_backlight(True)
+        self.display_mgr.show_splash(status)
+        self.timelapse_backlight_off_time = time.monotonic() + duration
+
+    def handle_timelapse_state(self):
+        timelapse_mgr = self.timelapse_mgr
+
+        if self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_UP_PIN):
+            timelapse_mgr.stop()
+            if self.job_mgr:
+                self.job_mgr.resume()
+            self.display_mgr.set_backlight(True)
+            self.camera_mgr.resume_preview()
+            self.state = State.PREVIEW
+            return
+
+        if self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_PRESS_PIN):
+            self._show_timelapse_status()
+
+        if self.timelapse_backlight_off_time is not None and time.monotonic() >= self.timelapse_backlight_off_time:
+            self.display_mgr.set_backlight(False)
+            self.timelapse_backlight_off_time = None
+
+        timelapse_mgr.maybe_sample_current()
+
+        # 尚未到拍攝時間時休眠後返回，讓主循環仍能檢查退出按鍵
+        if not timelapse_mgr.sleep_until_next():
+            return
+
+        wake_time = time.monotonic()
+        # 每張拍攝前讀取一次電流，涵蓋整段待機期間
+        timelapse_mgr.sample_current()
+        image = self.camera_mgr.capture_still_from_stopped()
+        if image is not None:
+            # 直接寫入縮時資料夾，不產生縮略圖也不重新掃描相簿目錄
+            self._save_image(image, timelapse_mgr.next_frame_path(), make_thumbnail=False,
+                             on_saved=lambda image_path, ok: timelapse_mgr.on_frame_saved(wake_time, image_path, ok))
+        else:
+            logging.error("縮時拍攝失敗")
+        timelapse_mgr.advance()
+
+        frames_left = timelapse_mgr.estimate_frames_left()
+        if frames_left is not None:
+            logging.info(f"依目前耗電估計，電池約可再拍 {frames_left} 張")
+
     def handle_capture_state(self):
         logging.info("開始拍照...")
 
-        high_res_image = self.camera_mgr.capture_high_res_image_to_memory()
+        sharpness = None
+        if self.capture_mode == CaptureMode.NIGHT:
+            high_res_image = self._capture_night_image()
+        elif self.capture_mode == CaptureMode.SHARP:
+            high_res_image, sharpness = self._capture_sharpest_image()
+        else:
+            high_res_image = self.camera_mgr.capture_high_res_image_to_memory()
 
         if high_res_image is not None:
-            def save_image_and_thumbnail(image):
-                current_time = time.strftime("%Y%m%d_%H%M%S")
-                image_path = os.path.join(self.thumbnail_mgr.save_dir, f"{current_time}.jpg")
-                if cv2.imwrite(image_path, image):
-                    self.thumbnail_mgr.update_image_list()
-                    logging.info(f"圖片已保存: {image_path}")
+            # 有背景工作佇列時，拍攝流程只負責把照片安全寫入，清晰度評分延後到閒置時
+            if sharpness is None and not self.job_mgr:
+                sharpness = score_sharpness(high_res_image)
+            if sharpness is not None and self.camera_mgr.last_focus_timed_out and sharpness < self.blur_threshold:
+                logging.warning(f"對焦超時且清晰度偏低 ({sharpness:.1f})，可改用清晰優先模式")
+
+            current_time = time.strftime("%Y%m%d_%H%M%S")
+            image_path = os.path.join(self.thumbnail_mgr.save_dir, f"{current_time}.jpg")
+
+            def on_saved(saved_path, ok):
+                if not ok or not self.job_mgr:
+                    self._on_image_saved(saved_path, ok)
+                    if ok:
+                        self.thumbnail_mgr.set_photo_metadata(saved_path, sharpness=round(sharpness, 1))
+                    return
+                # 清晰度分數隨照片一起保存，讓相簿可以標示模糊的照片；與縮略圖等工作在同一次提交中排入
+                if sharpness is None:
+                    jobs = [("analyze", saved_path, 10, None)]
                 else:
-                    logging.error(f"保存圖片失敗: {image_path}")
+                    jobs = [("metadata", saved_path, 15, {"sharpness": round(sharpness, 1)})]
+                self._on_image_saved(saved_path, ok, jobs)
 
-            Thread(target=save_image_and_thumbnail, args=(high_res_image,)).start()
+            self._save_image(high_res_image, image_path, make_thumbnail=not self.job_mgr, on_saved=on_saved)
             logging.info("後台保存中，返回到預覽模式...")
         else:
             logging.error("未捕捉到有效的圖片")
 
         self.state = State.PREVIEW
 
+    def _capture_night_image(self):
+        """連拍多張並逐張對齊累加，只保留一個累加緩衝區。"""
+        stacker = StackingManager()
+        self.camera_mgr.capture_burst(self.night_frames, stacker.add)
+        return stacker.result()
+
+    def _capture_sharpest_image(self):
+        """連拍數張並逐張評分，只保留最清晰的一張。"""
+        selector = SharpestFrameSelector()
+        self.camera_mgr.capture_burst(self.sharp_frames, selector.add)
+        return selector.result()
+
+    def _save_image(self, image, image_path, make_thumbnail=True, on_saved=None):
+        """
+        在背景保存影像。有編碼工作行程時交給工作行程，否則使用執行緒保存。
+        有寫回管理器時先寫入 RAM 暫存區，寫回 SD 卡並 fsync 後才呼叫 on_saved。
+        on_saved 預設為更新影像清單。
+        """
+        on_saved = on_saved or self._on_image_saved
+        thumbnail_path = self.thumbnail_mgr.get_thumbnail_path(image_path) if make_thumbnail else None
+        write_path, thumbnail_write_path = image_path, thumbnail_path
+        if self.writeback_mgr:
+            write_path = self.writeback_mgr.begin(image_path)
+            if thumbnail_path:
+                thumbnail_write_path = self.writeback_mgr.begin(thumbnail_path, 64 * 1024)
+
+        def finish(written_path, ok):
+            if not self.writeback_mgr:
+                on_saved(image_path, ok)
+                return
+            if thumbnail_write_path:
+                if ok and os.path.exists(thumbnail_write_path):
+                    self.writeback_mgr.commit(thumbnail_write_path, thumbnail_path)
+                else:
+                    self.writeback_mgr.abort(thumbnail_write_path)
+            if ok:
+                self.writeback_mgr.commit(write_path, image_path, on_saved)
+            else:
+                self.writeback_mgr.abort(write_path)
+                on_saved(image_path, False)
+
+        if self.encode_mgr:
+            if self.encode_mgr.submit(image, write_path, thumbnail_write_path, on_saved=finish):
+                return
+
+        def save_image_and_thumbnail(image):
+            ok = write_jpeg(write_path, image)
+            if ok:
+                if thumbnail_write_path:
+                    write_thumbnail(thumbnail_write_path, resize_to_fit(image))
+                logging.info(f"圖片已寫入: {write_path}")
+            else:
+                logging.error(f"保存圖片失敗: {image_path}")
+            finish(write_path, ok)
+
+        Thread(target=save_image_and_thumbnail, args=(image,)).start()
+
+    def _on_image_saved(self, image_path, ok, jobs=()):
+        """影像保存完成後更新影像清單；jobs 為要一併排入的其他背景工作。"""
+        if not ok:
+            return
+        if self.job_mgr:
+            # 只把新照片加入清單，縮略圖與完整的目錄掃描交給背景工作，每張照片只提交一次
+            self.thumbnail_mgr.add_image(image_path)
+            jobs = [("thumbnail", image_path, 20, None), ("catalog", "all", 5, None)] + list(jobs)
+            if any(kind in ("analyze", "metadata") for kind, _, _, _ in jobs):
+                # metadata.json 延後到這批分析都完成後才整個寫回一次
+                jobs.append(("save_metadata", "all", 1, None))
+            self.job_mgr.enqueue_many(jobs)
+        else:
+            self.thumbnail_mgr.update_image_list()
+
+    def _analyze_photo(self, image_path, payload=None):
+        """背景工作：讀取照片並記錄清晰度與尺寸。"""
+        # 評分只需 576 寬的灰階影像；1/4 解碼後仍大於此寬度，再由 score_sharpness 以區域平均縮小，
+        # 與拍攝時直接評分的尺度一致，不必完整解碼 12MP 的照片
+        image = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if image is None:
+            raise ValueError(f"無法讀取照片: {image_path}")
+        width, height = read_jpeg_size(image_path) or (image.shape[1] * 4, image.shape[0] * 4)
+        self.thumbnail_mgr.set_photo_metadata(image_path, save=False, sharpness=round(score_sharpness(image), 1),
+                                              width=width, height=height)
+
+    def _job_progress_text(self):
+        """背景工作尚未完成時，在狀態文字後顯示剩餘數量。"""
+        if not self.job_mgr:
+            return ""
+        _, pending = self.job_mgr.get_progress()
+        return f" Q{pending}" if pending else ""
+
     def handle_view_image_state(self):
+        # 清單可能在其他執行緒被替換 (例如匯出後刪除照片)，每幀以同一份快照檢查索引
+        image_paths = self.thumbnail_mgr.image_paths
+        total_images = len(image_paths)
+        if total_images == 0:
+            logging.info("相簿沒有照片，返回預覽")
+            self.image_index = None
+            self.state = State.PREVIEW
+            return
         if self.image_index is None:
-            self.image_index = len(self.thumbnail_mgr.image_paths) - 1
+            self.image_index = total_images - 1
 
         if self.image_index is not None:
-            image_path = self.thumbnail_mgr.image_paths[self.image_index]
-            image = self.thumbnail_mgr.load_or_generate_thumbnail(image_path)
+            disp = self.display_mgr.disp
+
+            # 左右鍵按住時加速捲動，一次可能移動多張
+            steps = self.key_mgr.check_key_repeat(disp.GPIO_KEY_RIGHT_PIN) - self.key_mgr.check_key_repeat(disp.GPIO_KEY_LEFT_PIN)
+            if steps:
+                self.scroll_direction = 1 if steps > 0 else -1
+            self.image_index = max(0, min(self.image_index + steps, total_images - 1))
+            scrolling = self.key_mgr.is_key_repeating(disp.GPIO_KEY_LEFT_PIN) or self.key_mgr.is_key_repeating(disp.GPIO_KEY_RIGHT_PIN)
+            image_path = image_paths[self.image_index]
+
+            if scrolling:
+                # 快速捲動時只顯示低解析度預覽，並沿捲動方向預先解碼接下來的預覽
+                image = self.prefetch_mgr.get_placeholder(image_path)
+                if self.image_index != self.prefetch_index:
+                    self.prefetch_index = self.image_index
+                    ahead = range(self.image_index + self.scroll_direction, self.image_index + self.scroll_direction * 17, self.scroll_direction)
+                    self.prefetch_mgr.schedule([image_paths[i] for i in ahead if 0 <= i < total_images], full=False)
+                self.scroll_settled = False
+            else:
+                # 停下後才顯示完整縮略圖，並預先解碼前進方向的下幾張與反方向的一張
+                image = self.prefetch_mgr.load_thumbnail(image_path)
+                if self.image_index != self.prefetch_index or not self.scroll_settled:
+                    self.prefetch_index = self.image_index
+                    direction = self.scroll_direction
+                    neighbours = [self.image_index + direction, self.image_index + direction * 2, self.image_index + direction * 3, self.image_index - direction]
+                    self.prefetch_mgr.schedule([image_paths[i] for i in neighbours if 0 <= i < total_images])
+                if not self.scroll_settled:
+                    self.scroll_settled = True
+                    completed, cancelled = self.prefetch_mgr.pop_stats()
+                    logging.info(f"捲動停止於 {self.image_index + 1}/{total_images}，預先解碼 {completed} 張，取消 {cancelled} 個過時的工作")
 
             if image is None:
-                logging.error(f"無法加載圖片: {image_path}")
+                if not scrolling:
+                    logging.error(f"無法加載圖片: {image_path}")
                 return
 
             filename = os.path.basename(image_path).split(".")[0]
@@ -89,27 +471,188 @@ class StateMachine:
             image_date = f"{date_part[:4]}/{date_part[4:6]:0>2}/{date_part[6:8]:0>2}"
             image_time = f"{time_part[:2]}:{time_part[2:4]}:{time_part[4:6]}"
 
-            total_images = len(self.thumbnail_mgr.image_paths)
             current_image_info = f"{self.image_index + 1}/{total_images}"
+            if self.thumbnail_mgr.is_video(image_path):
+                current_image_info += " VID"
+            current_image_info += self._job_progress_text()
+            sharpness = self.thumbnail_mgr.get_photo_metadata(image_path).get("sharpness")
+            if sharpness is not None and sharpness < self.blur_threshold:
+                current_image_info += " BLUR"
+            if self.view_notice is not None:
+                if time.monotonic() < self.view_notice[1]:
+                    current_image_info += self.view_notice[0]
+                else:
+                    self.view_notice = None
 
             battery_percentage = self.battery_mgr.get_battery_percentage()
 
             self.display_mgr.display_image_with_state(image, current_image_info, date_text=image_date, time_text=image_time, battery_percentage=battery_percentage)
 
-            if self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_LEFT_PIN):
-                if self.image_index > 0:
-                    self.image_index -= 1
-            elif self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_RIGHT_PIN):
-                if self.image_index < len(self.thumbnail_mgr.image_paths) - 1:
-                    self.image_index += 1
-
             if self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_UP_PIN):
                 self.state = State.PREVIEW
+            elif self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_DOWN_PIN):
+                self.grid_frame = None
+                self.grid_view = None
+                self.state = State.GRID
+            elif self.key_mgr.check_key_pressed(self.display_mgr.disp.GPIO_KEY_PRESS_PIN):
+                if not self.thumbnail_mgr.is_video(image_path):
+                    self.zoom_path = image_path
+                    self.zoom_level = None
+                    self.zoom_center = (0.5, 0.5)
+                    self.zoom_frame = None
+                    self.zoom_view = None
+                    self.state = State.ZOOM
+
+    def handle_zoom_state(self):
+        disp = self.display_mgr.disp
+        image_path = self.zoom_path
+        image_paths = self.thumbnail_mgr.image_paths
+        if image_path not in image_paths:
+            # 放大中的照片已被刪除，回到單張檢視 (清單為空時由單張檢視返回預覽)
+            logging.info(f"放大中的照片已不存在: {image_path}")
+            self.image_index = min(self.image_index or 0, len(image_paths) - 1) if image_paths else None
+            self.state = State.VIEW_IMAGE
+            return
+
+        if self.key_mgr.check_key_pressed(disp.GPIO_KEY_PRESS_PIN):
+            self.state = State.VIEW_IMAGE
+            return
+
+        meta = self.pyramid_mgr.get_meta(image_path)
+        if meta is None and self.pyramid_mgr.is_failed(image_path):
+            logging.error(f"無法放大照片: {image_path}")
+            self.view_notice = (" ZOOM ERR", time.monotonic() + 3)
+            self.state = State.VIEW_IMAGE
+            return
+        if meta is None:
+            # 第一次放大這張照片，金字塔在背景產生，期間先顯示縮略圖
+            if self.zoom_view != "loading":
+                thumbnail = self.thumbnail_mgr.load_or_generate_thumbnail(image_path)
+                if thumbnail is not None:
+                    self.display_mgr.display_image_with_state(thumbnail, "Loading...", date_text="", battery_percentage=self.battery_mgr.get_battery_percentage())
+                self.zoom_view = "loading"
+                self.zoom_frame = None
+            time.sleep(0.05)
+            return
+
+        levels = meta["levels"]
+        if self.zoom_level is None:
+            self.zoom_level = len(levels) - 1
+        level = self.zoom_level
+        width, height = levels[level]
+        center_x, center_y = self.zoom_center
+        step_x, step_y = 120 / width, 120 / height  # 每次平移半個畫面
+
+        if self.key_mgr.check_key_pressed(disp.GPIO_KEY_LEFT_PIN):
+            center_x -= step_x
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY_RIGHT_PIN):
+            center_x += step_x
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY_UP_PIN):
+            center_y -= step_y
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY_DOWN_PIN):
+            center_y += step_y
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY1_PIN):
+            level = max(0, level - 1)
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY2_PIN):
+            if level == len(levels) - 1:
+                self.state = State.VIEW_IMAGE
+                return
+            level += 1
+
+        # 中心點限制在畫面不會超出影像的範圍
+        width, height = levels[level]
+        half_x, half_y = min(0.5, 120 / width), min(0.5, 120 / height)
+        center_x = min(max(center_x, half_x), 1 - half_x)
+        center_y = min(max(center_y, half_y), 1 - half_y)
+        self.zoom_level = level
+        self.zoom_center = (center_x, center_y)
+
+        view = (image_path, level, center_x, center_y, self.pyramid_mgr.is_level_ready(image_path, level))
+        if view == self.zoom_view:
+            time.sleep(0.02)
+            return
+
+        thumbnail = None if view[-1] else self.thumbnail_mgr.load_or_generate_thumbnail(image_path)
+        frame = self.pyramid_mgr.render(image_path, meta, level, center_x, center_y, thumbnail)
+        if frame is None:
+            return
+        # 金字塔以 BGR 保存，轉為螢幕使用的 RGB
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        zoom_text = f"{width * 100 // levels[0][0]}%"
+        if not view[-1]:
+            zoom_text += " ..."
+        cv2.putText(frame, zoom_text, (10, 230), cv2.FONT_HERSHEY_COMPLEX, 0.5, (0, 255, 0), 1)
+        self.display_mgr.display_changed_rows(frame, self.zoom_frame)
+        self.zoom_frame = frame
+        self.zoom_view = view
+
+    def handle_grid_state(self):
+        image_paths = self.thumbnail_mgr.image_paths
+        total_images = len(image_paths)
+        if total_images == 0:
+            self.state = State.PREVIEW
+            return
+
+        disp = self.display_mgr.disp
+        grid_mgr = self.grid_mgr
+        selected = min(self.image_index if self.image_index is not None else total_images - 1, total_images - 1)
+        top_row = self.grid_top_row
+
+        if self.key_mgr.check_key_pressed(disp.GPIO_KEY_PRESS_PIN):
+            # 開啟選取的照片
+            self.image_index = selected
+            self.state = State.VIEW_IMAGE
+            return
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY_LEFT_PIN):
+            selected -= 1
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY_RIGHT_PIN):
+            selected += 1
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY_UP_PIN):
+            selected -= grid_mgr.cols
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY_DOWN_PIN):
+            selected += grid_mgr.cols
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY1_PIN):
+            # 整頁捲動
+            selected += grid_mgr.page_size
+            top_row += grid_mgr.rows
+        elif self.key_mgr.check_key_pressed(disp.GPIO_KEY2_PIN):
+            selected -= grid_mgr.page_size
+            top_row -= grid_mgr.rows
+
+        selected = max(0, min(selected, total_images - 1))
+        top_row = grid_mgr.clamp_top_row(top_row, selected, total_images)
+        self.image_index = selected
+        self.grid_top_row = top_row
+
+        view = (selected, top_row, total_images)
+        if view == self.grid_view and self.grid_frame is not None:
+            time.sleep(0.02)
+            return
+
+        filename = os.path.basename(image_paths[selected])
+        header_text = f"{selected + 1}/{total_images} {filename[:4]}/{filename[4:6]}/{filename[6:8]}"
+        header_text += self._job_progress_text()
+        frame = grid_mgr.compose(image_paths, top_row, selected, header_text)
+        rows_sent = self.display_mgr.display_changed_rows(frame, self.grid_frame)
+        logging.debug(f"格狀檢視更新 {rows_sent} 列")
+        self.grid_frame = frame
+        self.grid_view = view
 
     def run(self):
+        if self.job_mgr:
+            # 即時預覽中不算閒置，背景工作不與預覽爭用 CPU
+            self.job_mgr.set_foreground_busy(self.state == State.PREVIEW)
         if self.state == State.PREVIEW:
             self.handle_preview_state()
         elif self.state == State.VIEW_IMAGE:
             self.handle_view_image_state()
         elif self.state == State.CAPTURE:
             self.handle_capture_state()
+        elif self.state == State.TIMELAPSE:
+            self.handle_timelapse_state()
+        elif self.state == State.VIDEO:
+            self.handle_video_state()
+        elif self.state == State.GRID:
+            self.handle_grid_state()
+        elif self.state == State.ZOOM:
+            self.handle_zoom_state()
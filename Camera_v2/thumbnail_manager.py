@@ -2,8 +2,69 @@
 
 import os
 import cv2
+import json
 import logging
-from threading import Thread
+from threading import Lock, Thread, get_ident
+
+IMAGE_EXTENSIONS = (".jpg",)
+VIDEO_EXTENSIONS = (".h264",)
+
+def resize_to_fit(image, max_width=240, max_height=135):
+    """將圖像等比例縮放至不超過指定尺寸，可在工作行程中直接使用。"""
+    original_height, original_width = image.shape[:2]
+    scale = min(max_width / original_width, max_height / original_height)
+    new_size = (int(original_width * scale), int(original_height * scale))
+    return cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+
+def write_thumbnail(thumbnail_path, thumbnail):
+    """
+    將縮略圖寫入暫存檔後再取代正式檔名。縮略圖會由多個執行緒或工作行程同時產生與讀取，
+    讀取端不會讀到寫到一半的檔案；暫存檔名含行程與執行緒編號，同時寫入同一張也不會互相覆蓋。
+    路徑以 .part 結尾時已是寫回管理器的暫存檔 (由 commit 負責 rename)，直接寫入。
+    """
+    ok, buffer = cv2.imencode(".jpg", thumbnail)
+    if not ok:
+        return False
+    if thumbnail_path.endswith(".part"):
+        with open(thumbnail_path, "wb") as f:
+            f.write(buffer)
+        return True
+    temp_path = f"{thumbnail_path}.{os.getpid()}.{get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(buffer)
+        os.replace(temp_path, thumbnail_path)
+        return True
+    except OSError as e:
+        logging.error(f"Failed to write thumbnail: {thumbnail_path}: {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+
+def read_jpeg_size(path):
+    """只讀取 JPEG 標頭的 SOF 區段取得 (寬, 高)，不解碼影像；無法判讀時回傳 None。"""
+    try:
+        with open(path, "rb") as f:
+            if f.read(2) != b"\xff\xd8":
+                return None
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                    continue
+                length = int.from_bytes(f.read(2), "big")
+                # SOF0~SOF15，排除 DHT (C4)、JPG (C8)、DAC (CC)
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    header = f.read(5)
+                    if len(header) < 5:
+                        return None
+                    return int.from_bytes(header[3:5], "big"), int.from_bytes(header[1:3], "big")
+                f.seek(length - 2, os.SEEK_CUR)
+    except OSError:
+        return None
 
 class ThumbnailManager:
     def __init__(self, save_dir, thumbnail_dir):
@@ -12,49 +73,127 @@ class ThumbnailManager:
         os.makedirs(self.thumbnail_dir, exist_ok=True)
         self.image_paths = self._get_image_paths_sorted()
         self.thumbnail_cache = {}
+        self.job_mgr = None  # 設定後，縮略圖補齊改由背景工作佇列在閒置時執行
+
+        # 每張照片的附加資訊 (例如清晰度分數)，與縮略圖一起保存
+        self.metadata_path = os.path.join(self.thumbnail_dir, "metadata.json")
+        self.metadata_lock = Lock()
+        self.photo_metadata = self._load_metadata()
+        self.metadata_dirty = False
+
+    def _load_metadata(self):
+        try:
+            with open(self.metadata_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.error(f"Failed to load photo metadata: {e}")
+            return {}
+
+    def get_photo_metadata(self, image_path):
+        """回傳照片的附加資訊，沒有時回傳空字典"""
+        return self.photo_metadata.get(os.path.basename(image_path), {})
+
+    def set_photo_metadata(self, image_path, save=True, **fields):
+        """更新照片的附加資訊；save 為 False 時只更新記憶體，之後由 save_photo_metadata 一次寫回"""
+        with self.metadata_lock:
+            self.photo_metadata.setdefault(os.path.basename(image_path), {}).update(fields)
+            self.metadata_dirty = True
+        if save:
+            self.save_photo_metadata()
+
+    def save_photo_metadata(self):
+        """有變更時將附加資訊寫回磁碟 (先寫入暫存檔再取代，避免中途斷電損毀)"""
+        with self.metadata_lock:
+            if not self.metadata_dirty:
+                return
+            temp_path = self.metadata_path + ".tmp"
+            try:
+                with open(temp_path, "w") as f:
+                    json.dump(self.photo_metadata, f)
+                os.replace(temp_path, self.metadata_path)
+                self.metadata_dirty = False
+            except Exception as e:
+                logging.error(f"Failed to save photo metadata: {e}")
 
     def _get_image_paths_sorted(self):
         """從保存路徑中獲取圖像文件並按時間排序"""
         try:
-            files = [os.path.join(self.save_dir, f) for f in os.listdir(self.save_dir) if f.endswith(".jpg")]
+            files = [os.path.join(self.save_dir, f) for f in os.listdir(self.save_dir) if f.endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)]
             files.sort(key=os.path.getctime)
             return files
         except Exception as e:
             logging.error(f"Failed to get image paths: {e}")
             return []
 
+    def get_thumbnail_path(self, image_path):
+        """回傳影像對應的縮略圖路徑，影片的封面縮略圖以 .jpg 結尾"""
+        name = os.path.basename(image_path)
+        if not name.endswith(IMAGE_EXTENSIONS):
+            name += ".jpg"
+        return os.path.join(self.thumbnail_dir, name)
+
+    def is_video(self, path):
+        return path.endswith(VIDEO_EXTENSIONS)
+
     def load_or_generate_thumbnail(self, image_path):
         """嘗試加載縮略圖，如果不存在就生成新的。"""
-        thumbnail_path = os.path.join(self.thumbnail_dir, os.path.basename(image_path))
+        thumbnail_path = self.get_thumbnail_path(image_path)
         if os.path.exists(thumbnail_path):
             return cv2.imread(thumbnail_path)
 
-        image = cv2.imread(image_path)
+        if self.is_video(image_path):
+            # 影片的封面在錄影開始時產生，這裡不解碼影片
+            logging.error(f"Missing video poster: {image_path}")
+            return None
+
+        # 以 1/4 解碼讀取即可產生 240x135 的縮略圖，比完整解碼快得多
+        image = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_4)
         if image is None or image.size == 0:
             logging.error(f"Failed to load image: {image_path}")
             return None
 
         thumbnail = self.generate_thumbnail(image)
-        cv2.imwrite(thumbnail_path, thumbnail)
+        write_thumbnail(thumbnail_path, thumbnail)
         return thumbnail
 
     def generate_thumbnail(self, image, max_width=240, max_height=135):
         """生成縮略圖，將圖像的尺寸調整至最大為 240x135"""
-        original_height, original_width = image.shape[:2]
-        scale = min(max_width / original_width, max_height / original_height)
-        new_size = (int(original_width * scale), int(original_height * scale))
-        return cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+        return resize_to_fit(image, max_width, max_height)
 
     def preload_thumbnails(self):
         """後台檢查並生成缺少的縮略圖"""
+        if self.job_mgr:
+            job_mgr = self.job_mgr
+
+            def check_and_enqueue():
+                # 缺少的縮略圖一次排入，整批只提交一次
+                missing = [image_path for image_path in self.image_paths if not os.path.exists(self.get_thumbnail_path(image_path))]
+                job_mgr.enqueue_many([("thumbnail", image_path, 0, None) for image_path in missing])
+                if missing:
+                    logging.info(f"已排入 {len(missing)} 張缺少的縮略圖")
+
+            Thread(target=check_and_enqueue, daemon=True).start()
+            return
+
         def check_and_generate():
             for image_path in self.image_paths:
-                thumbnail_path = os.path.join(self.thumbnail_dir, os.path.basename(image_path))
+                thumbnail_path = self.get_thumbnail_path(image_path)
                 if not os.path.exists(thumbnail_path):
                     self.load_or_generate_thumbnail(image_path)
 
         Thread(target=check_and_generate, daemon=True).start()
 
+    def add_image(self, image_path):
+        """新增剛保存的影像到清單末端，不重新掃描目錄"""
+        if image_path not in self.image_paths:
+            self.image_paths = self.image_paths + [image_path]
+
+    def refresh_image_list(self):
+        """重新掃描目錄但不補齊縮略圖"""
+        self.image_paths = self._get_image_paths_sorted()
+
     def update_image_list(self):
         """更新影像清單並檢查是否有新的縮略圖需要生成"""
         self.image_paths = self._get_image_paths_sorted()
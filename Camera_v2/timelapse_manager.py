@@ -0,0 +1,112 @@
+# timelapse_manager.py
+
+import logging
+import os
+import time
+from latency_tracker import LatencyTracker
+
+class TimelapseManager:
+    def __init__(self, save_dir, battery_mgr, interval=10, current_sample_interval=10, poll_interval=0.5):
+        """
+        縮時攝影排程器。拍攝時間固定為 start + n * interval，不會因每張的處理時間累積漂移。
+        等待期間每 poll_interval 秒醒來檢查按鍵 (只讀 GPIO)，INA219 的電流最多每 current_sample_interval 秒讀取一次，
+        另外在每張拍攝前讀取一次。
+        """
+        self.save_dir = save_dir
+        self.battery_mgr = battery_mgr
+        self.interval = interval
+        self.current_sample_interval = current_sample_interval
+        self.poll_interval = poll_interval
+
+        self.active = False
+        self.session_dir = None
+        self.start_time = None
+        self.frame_index = 0
+        self.frames_saved = 0
+        self.wake_latency = LatencyTracker("縮時喚醒至保存", report_interval=0)
+
+        # 以時間加權平均估算整個拍攝週期的平均電流
+        self.current_samples_mah = 0.0
+        self.current_samples_time = 0.0
+        self.last_current_sample_time = None
+
+    def start(self):
+        """開始新的縮時拍攝，影像保存到獨立的資料夾。"""
+        self.session_dir = os.path.join(self.save_dir, time.strftime("timelapse_%Y%m%d_%H%M%S"))
+        os.makedirs(self.session_dir, exist_ok=True)
+        self.start_time = time.monotonic()
+        self.frame_index = 0
+        self.frames_saved = 0
+        self.current_samples_mah = 0.0
+        self.current_samples_time = 0.0
+        self.last_current_sample_time = None
+        self.active = True
+        logging.info(f"開始縮時攝影: 間隔 {self.interval} 秒, 保存至 {self.session_dir}")
+
+    def stop(self):
+        self.active = False
+        logging.info(f"縮時攝影結束: 共保存 {self.frames_saved} 張")
+        if self.wake_latency.samples:
+            logging.info(self.wake_latency.format_stats())
+
+    def next_deadline(self):
+        return self.start_time + self.frame_index * self.interval
+
+    def time_until_next(self):
+        return self.next_deadline() - time.monotonic()
+
+    def sleep_until_next(self):
+        """休眠到下一張或下一次按鍵檢查，回傳是否已到拍攝時間。"""
+        wait_time = self.time_until_next()
+        if wait_time <= 0:
+            return True
+        time.sleep(min(wait_time, self.poll_interval))
+        return False
+
+    def next_frame_path(self):
+        return os.path.join(self.session_dir, f"frame_{self.frame_index:05d}.jpg")
+
+    def advance(self):
+        """排到下一個拍攝時間點；若處理時間超過間隔，略過已錯過的時間點而非延後整個排程。"""
+        elapsed_slots = int((time.monotonic() - self.start_time) // self.interval)
+        skipped = elapsed_slots - self.frame_index
+        if skipped > 0:
+            logging.warning(f"縮時拍攝落後，略過 {skipped} 個時間點")
+        self.frame_index = max(self.frame_index, elapsed_slots) + 1
+
+    def on_frame_saved(self, wake_time, image_path, ok):
+        """影像寫入完成時呼叫，記錄喚醒至保存的延遲。"""
+        if not ok:
+            logging.error(f"縮時影像保存失敗: {image_path}")
+            return
+        self.frames_saved += 1
+        latency = time.monotonic() - wake_time
+        self.wake_latency.add(latency)
+        logging.info(f"縮時影像 {os.path.basename(image_path)}: 喚醒至保存 {latency:.2f} 秒")
+
+    def maybe_sample_current(self):
+        """距離上次讀取超過 current_sample_interval 秒時才讀取電流，避免頻繁喚醒 I2C。"""
+        if self.last_current_sample_time is None or time.monotonic() - self.last_current_sample_time >= self.current_sample_interval:
+            self.sample_current()
+
+    def sample_current(self):
+        """記錄一次電流讀數，用於估算平均耗電 (讀數代表自上次讀取以來的平均電流)。"""
+        current_ma = self.battery_mgr.get_current_ma() if self.battery_mgr else None
+        current_time = time.monotonic()
+        if current_ma is not None and self.last_current_sample_time is not None:
+            duration = current_time - self.last_current_sample_time
+            # 放電電流為負值，取其大小
+            self.current_samples_mah += max(0.0, -current_ma) * duration
+            self.current_samples_time += duration
+        self.last_current_sample_time = current_time
+
+    def estimate_frames_left(self):
+        """依平均放電電流與剩餘容量估算還能拍幾張；資料不足或充電中時回傳 None。"""
+        if self.current_samples_time <= 0 or not self.battery_mgr:
+            return None
+        average_current_ma = self.current_samples_mah / self.current_samples_time
+        remaining_mah = self.battery_mgr.get_remaining_capacity_mah()
+        if remaining_mah is None or average_current_ma <= 0:
+            return None
+        hours_left = remaining_mah / average_current_ma
+        return int(hours_left * 3600 / self.interval)
@@ -0,0 +1,282 @@
+# video_manager.py
+
+import logging
+import os
+import queue
+import time
+from threading import Thread
+
+import cv2
+from picamera2.encoders import H264Encoder
+from picamera2.outputs import Output
+from thumbnail_manager import resize_to_fit, write_thumbnail
+
+class QueuedFileOutput(Output):
+    def __init__(self, file_path, frame_interval_us, max_queue=150, on_closed=None):
+        """
+        編碼器輸出：編碼後的資料先放入佇列，由獨立的寫入執行緒寫入檔案，
+        UI 執行緒不會因 SD 卡寫入而阻塞。佇列最多 max_queue 個封包 (30 FPS 約 5 秒)，
+        SD 卡持續跟不上時由編碼器端等待，記憶體用量不會無限增加。
+        停止後寫入執行緒在背景寫完剩餘資料並關閉檔案，完成後呼叫 on_closed(file_path, ok)。
+        """
+        super().__init__()
+        self.file_path = file_path
+        self.frame_interval_us = frame_interval_us
+        self.on_closed = on_closed
+        self.file = open(file_path, "wb")
+        self.write_queue = queue.Queue(maxsize=max_queue)
+        self.write_failed = False
+        self.stopping = False
+        self.writer_thread = Thread(target=self._write_loop, daemon=True)
+        self.writer_thread.start()
+
+        self.frames = 0
+        self.bytes_written = 0
+        self.dropped_frames = 0
+        self.max_backlog = 0
+        self.last_timestamp = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if audio or not self.recording:
+            return
+
+        # 依時間戳記的間隔推算編碼器丟棄的畫面數
+        if timestamp is not None and self.last_timestamp is not None and self.frame_interval_us:
+            gap = timestamp - self.last_timestamp
+            if gap > 1.5 * self.frame_interval_us:
+                self.dropped_frames += int(round(gap / self.frame_interval_us)) - 1
+        self.last_timestamp = timestamp
+
+        self.frames += 1
+        self.write_queue.put(bytes(frame))
+        self.max_backlog = max(self.max_backlog, self.write_queue.qsize())
+
+    def _write_loop(self):
+        while True:
+            try:
+                data = self.write_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.stopping:
+                    break
+                continue
+            try:
+                self.file.write(data)
+                self.bytes_written += len(data)
+            except Exception as e:
+                self.write_failed = True
+                logging.error(f"寫入影片失敗: {e}")
+
+        try:
+            self.file.close()
+        except Exception as e:
+            self.write_failed = True
+            logging.error(f"關閉影片檔案失敗: {e}")
+        logging.info(f"影片已寫入: {self.file_path} ({self.bytes_written / 1e6:.1f} MB)")
+        if self.on_closed:
+            try:
+                self.on_closed(self.file_path, not self.write_failed)
+            except Exception as e:
+                logging.error(f"保存回呼執行失敗: {e}")
+
+    def stop(self):
+        super().stop()
+        # 不等待寫入完成：剩餘的資料由寫入執行緒在背景寫完後關閉檔案
+        self.stopping = True
+
+    def wait_until_closed(self, timeout=None):
+        self.writer_thread.join(timeout)
+        return not self.writer_thread.is_alive()
+
+
+class VideoManager:
+    def __init__(self, camera_mgr, thumbnail_mgr, main_size=(1920, 1080), lores_size=(320, 240),
+                 bitrate=10000000, framerate=30, preview_fps=10, encoder_factory=None):
+        """
+        錄影管理器：以 Picamera2 的編碼器 API 錄製 H.264，預覽改由 lores 串流以較低的頻率提供。
+        encoder_factory 可替換為軟體編碼器 (例如 picamera2.encoders.JpegEncoder) 以便在沒有硬體編碼器時測試。
+        """
+        self.camera_mgr = camera_mgr
+        self.thumbnail_mgr = thumbnail_mgr
+        self.main_size = main_size
+        self.lores_size = lores_size
+        self.bitrate = bitrate
+        self.framerate = framerate
+        self.preview_interval = 1.0 / preview_fps
+        self.encoder_factory = encoder_factory or (lambda: H264Encoder(bitrate=self.bitrate))
+
+        self.video_config = None
+        self.encoder = None
+        self.output = None
+        self.closing_outputs = []  # 已停止但仍在背景寫入的輸出
+        self.clip_path = None
+        self.start_time = None
+        self.last_preview_time = 0
+        self.report_interval = 10
+        self.last_report_time = 0
+
+    @property
+    def recording(self):
+        return self.output is not None
+
+    def _select_video_mode(self):
+        """
+        選擇錄影的感測器模式：至少與 main_size 一樣大，避免把裝箱後的小畫面放大成 1080p；
+        其中優先選能達到 framerate 的模式，再選面積最小 (讀出最快) 的模式。
+        """
+        modes = self.camera_mgr.picam2.sensor_modes
+        width, height = self.main_size
+        large_enough = [mode for mode in modes if mode['size'][0] >= width and mode['size'][1] >= height]
+        if not large_enough:
+            logging.warning(f"沒有不小於 {width}x{height} 的感測器模式，改用最大的模式錄影")
+            return max(modes, key=lambda mode: mode['size'][0] * mode['size'][1])
+        fast_enough = [mode for mode in large_enough if mode.get('fps', self.framerate) >= self.framerate]
+        mode = min(fast_enough or large_enough, key=lambda mode: mode['size'][0] * mode['size'][1])
+        logging.info(f"錄影感測器模式: {mode['size'][0]}x{mode['size'][1]}/{mode['bit_depth']}")
+        return mode
+
+    def _create_video_config(self):
+        picam2 = self.camera_mgr.picam2
+        mode = self._select_video_mode()
+        return picam2.create_video_configuration(main={"size": self.main_size},
+                                                 lores={"size": self.lores_size, "format": "YUV420"},
+                                                 sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']},
+                                                 controls={"FrameRate": self.framerate}, encode="main")
+
+    def start_recording(self):
+        """切換到錄影設定並開始錄製，回傳影片路徑；失敗時回傳 None。"""
+        picam2 = self.camera_mgr.picam2
+        clip_name = time.strftime("%Y%m%d_%H%M%S") + ".h264"
+        self.clip_path = os.path.join(self.thumbnail_mgr.save_dir, clip_name)
+        try:
+            if self.video_config is None:
+                self.video_config = self._create_video_config()
+            picam2.switch_mode(self.video_config)
+            self.camera_mgr.enable_continuous_focus()
+
+            self.encoder = self.encoder_factory()
+            self.closing_outputs = [output for output in self.closing_outputs if output.writer_thread.is_alive()]
+            self.output = QueuedFileOutput(self.clip_path, 1000000 / self.framerate)
+            picam2.start_encoder(self.encoder, self.output)
+            self.start_time = time.monotonic()
+            self.last_report_time = self.start_time
+            logging.info(f"開始錄影: {self.clip_path}")
+        except Exception as e:
+            logging.error(f"開始錄影失敗: {e}")
+            self._discard_output()
+            self._restore_preview()
+            return None
+
+        # 開始錄影時就以 lores 畫面產生封面縮略圖，之後相簿不需解碼影片
+        poster = self.capture_preview_frame()
+        if poster is not None:
+            Thread(target=self._save_poster, args=(poster, self.thumbnail_mgr.get_thumbnail_path(self.clip_path)), daemon=True).start()
+        return self.clip_path
+
+    def _discard_output(self):
+        """開始錄影失敗時停止寫入執行緒並刪除不完整的影片與封面，避免相簿出現空的影片。"""
+        output, self.output = self.output, None
+        self.encoder = None
+        if output is None:
+            return
+        output.on_closed = None
+        output.stop()
+        if not output.wait_until_closed(timeout=5):
+            logging.error(f"影片寫入執行緒未結束: {output.file_path}")
+        for path in (output.file_path, self.thumbnail_mgr.get_thumbnail_path(output.file_path)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"刪除不完整的影片失敗: {path}: {e}")
+
+    def _save_poster(self, poster, thumbnail_path):
+        if not write_thumbnail(thumbnail_path, resize_to_fit(poster)):
+            logging.error(f"保存影片封面失敗: {thumbnail_path}")
+
+    def capture_preview_frame(self):
+        """從 lores 串流取得一張 BGR 預覽畫面。"""
+        try:
+            yuv = self.camera_mgr.picam2.capture_array("lores")
+            return cv2.cvtColor(yuv, cv2.COLOR_YUV420p2BGR)
+        except Exception as e:
+            logging.error(f"取得錄影預覽失敗: {e}")
+            return None
+
+    def preview_due(self):
+        """錄影時預覽以較低頻率更新，把 CPU 留給編碼與寫入。"""
+        current_time = time.monotonic()
+        if current_time - self.last_preview_time >= self.preview_interval:
+            self.last_preview_time = current_time
+            return True
+        return False
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time if self.start_time else 0
+
+    def get_stats(self):
+        """回傳錄影統計：畫面數、丟幀數、寫入量與編碼吞吐量。"""
+        if self.output is None:
+            return None
+        elapsed = max(self.elapsed(), 1e-6)
+        return {
+            "frames": self.output.frames,
+            "dropped_frames": self.output.dropped_frames,
+            "bytes_written": self.output.bytes_written,
+            "fps": self.output.frames / elapsed,
+            "mbps": self.output.bytes_written * 8 / elapsed / 1e6,
+            "max_backlog": self.output.max_backlog,
+        }
+
+    def maybe_report(self):
+        """錄影中定期將編碼吞吐量與丟幀數寫入日誌。"""
+        current_time = time.monotonic()
+        if self.output is None or current_time - self.last_report_time < self.report_interval:
+            return
+        self.last_report_time = current_time
+        stats = self.get_stats()
+        logging.info(f"錄影中: {stats['frames']} 幀, 丟幀 {stats['dropped_frames']}, {stats['fps']:.1f} FPS, "
+                     f"{stats['mbps']:.2f} Mbps, 寫入佇列 {self.output.write_queue.qsize()}")
+
+    def stop_recording(self, on_saved=None):
+        """
+        停止錄影並回到預覽設定，回傳影片路徑。
+        剩餘的資料在背景寫入，檔案關閉後才呼叫 on_saved(影片路徑, ok)。
+        """
+        if self.output is None:
+            return None
+
+        output = self.output
+        output.on_closed = on_saved
+        try:
+            self.camera_mgr.picam2.stop_encoder()
+        except Exception as e:
+            logging.error(f"停止錄影失敗: {e}")
+            output.stop()
+        stats = self.get_stats()
+        logging.info(f"錄影結束: {self.clip_path}, {stats['frames']} 幀, 丟幀 {stats['dropped_frames']}, "
+                     f"{stats['fps']:.1f} FPS, 寫入佇列最大 {stats['max_backlog']}, 尚待寫入 {output.write_queue.qsize()}")
+
+        self.closing_outputs.append(output)
+        self.output = None
+        self.encoder = None
+        self.start_time = None
+        self._restore_preview()
+        return self.clip_path
+
+    def wait_until_written(self, timeout=30):
+        """等待已停止的影片全部寫入並關閉，程式結束前呼叫。"""
+        deadline = time.monotonic() + timeout
+        for output in self.closing_outputs:
+            if not output.wait_until_closed(max(0, deadline - time.monotonic())):
+                logging.error(f"影片尚未寫完: {output.file_path}")
+                return False
+        return True
+
+    def _restore_preview(self):
+        try:
+            self.camera_mgr.picam2.switch_mode(self.camera_mgr.preview_config)
+            if not self.camera_mgr.focus_locked:
+                self.camera_mgr.enable_continuous_focus()
+        except Exception as e:
+            logging.error(f"切換回預覽模式失敗: {e}")
@@ -0,0 +1,390 @@
+# web_manager.py
+
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Event, Thread
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+import cv2
+
+# 可透過 /photos/<檔名> 下載的檔案類型
+PHOTO_CONTENT_TYPES = {".jpg": "image/jpeg", ".h264": "video/h264"}
+
+INDEX_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Pi Zero 2 Camera</title></head>
+<body>
+<h3>Pi Zero 2 Camera</h3>
+<img src="/stream.mjpg?token={token}"><br>
+<form method="post" action="/capture"><input name="token" type="hidden" value="{token}"><button>Capture</button></form>
+<a href="/photos?token={token}">Photos (JSON)</a> | <a href="/offload/manifest?token={token}">Offload manifest (JSON)</a>
+</body></html>
+"""
+
+# 首頁不需要權杖，只提供輸入權杖的表單；權杖正確時才顯示預覽與連結
+LOGIN_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Pi Zero 2 Camera</title></head>
+<body>
+<h3>Pi Zero 2 Camera</h3>
+<form method="get" action="/"><input name="token" type="password" placeholder="Token"> <button>Open</button></form>
+</body></html>
+"""
+
+class FrameBroadcaster:
+    def __init__(self, max_fps=10, max_width=640, jpeg_quality=70):
+        """
+        預覽畫面廣播器：每個畫面只編碼一次，所有客戶端共用同一份 JPEG。
+        編碼在獨立執行緒中進行，相機迴圈只需交出畫面的引用。
+        """
+        self.max_fps = max_fps
+        self.max_width = max_width
+        self.jpeg_quality = jpeg_quality
+
+        self.condition = Condition()
+        self.pending_frame = None
+        self.jpeg = None
+        self.sequence = 0
+        self.client_count = 0
+        self.running = True
+
+        self.encode_thread = Thread(target=self._encode_loop, daemon=True)
+        self.encode_thread.start()
+
+    def publish(self, frame):
+        """由相機迴圈呼叫；沒有客戶端時直接返回，不做任何編碼。"""
+        if self.client_count == 0:
+            return
+        with self.condition:
+            # 只保留最新的畫面，尚未編碼的舊畫面直接被覆蓋
+            self.pending_frame = frame
+            self.condition.notify_all()
+
+    def _encode_loop(self):
+        min_interval = 1.0 / self.max_fps
+        while self.running:
+            with self.condition:
+                while self.running and self.pending_frame is None:
+                    self.condition.wait()
+                frame, self.pending_frame = self.pending_frame, None
+            if frame is None:
+                continue
+
+            start_time = time.monotonic()
+            try:
+                jpeg = self._encode(frame)
+            except Exception as e:
+                logging.error(f"預覽串流編碼失敗: {e}")
+                continue
+
+            with self.condition:
+                self.jpeg = jpeg
+                self.sequence += 1
+                self.condition.notify_all()
+
+            # 限制串流幀率，避免編碼佔用過多 CPU
+            remaining = min_interval - (time.monotonic() - start_time)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _encode(self, frame):
+        # 預覽影像為 RGB(X) 排列，轉為 OpenCV 編碼所需的 BGR
+        if frame.shape[2] == 4:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        else:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        height, width = frame.shape[:2]
+        if width > self.max_width:
+            new_size = (self.max_width, int(height * self.max_width / width))
+            frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("JPEG 編碼失敗")
+        return buffer.tobytes()
+
+    def wait_for_frame(self, last_sequence, timeout=5.0):
+        """
+        等待比 last_sequence 更新的畫面。慢速客戶端只會拿到最新的一張，中間的畫面自動被略過。
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != last_sequence or not self.running, timeout=timeout)
+            return self.sequence, self.jpeg
+
+    def add_client(self):
+        with self.condition:
+            self.client_count += 1
+
+    def remove_client(self):
+        with self.condition:
+            self.client_count -= 1
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+
+class CameraRequestHandler(BaseHTTPRequestHandler):
+    server_version = "PiZeroCamera/1.0"
+
+    def log_message(self, format, *args):
+        logging.debug(f"HTTP {self.address_string()} {format % args}")
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/":
+            if self._authorized(b""):
+                token = quote(self.server.web_mgr.token, safe="")
+                self._send_bytes(INDEX_HTML.format(token=token).encode("utf-8"), "text/html; charset=utf-8")
+            else:
+                self._send_bytes(LOGIN_HTML.encode("utf-8"), "text/html; charset=utf-8")
+        elif path in ("/stream.mjpg", "/photos") or path.startswith("/photos/"):
+            # 預覽與相片需要權杖
+            if not self._require_token():
+                return
+            if path == "/stream.mjpg":
+                self._send_stream()
+            elif path == "/photos":
+                self._send_bytes(json.dumps(self.server.web_mgr.list_photos()).encode("utf-8"), "application/json")
+            else:
+                self._send_photo(unquote(path[len("/photos/"):]))
+        elif path in ("/offload/manifest", "/offload/batch") and self.server.web_mgr.offload_mgr:
+            # 匯出清單與批次內容等同整個相簿，同樣需要權杖
+            if not self._require_token():
+                return
+            if path == "/offload/manifest":
+                self._send_bytes(json.dumps({"files": self.server.web_mgr.offload_mgr.build_manifest()}).encode("utf-8"), "application/json")
+            else:
+                self._send_offload_batch(parse_qs(urlparse(self.path).query))
+        else:
+            self.send_error(404)
+
+    def _require_token(self, body=b""):
+        """權杖不正確時回應 403 並回傳 False。"""
+        if self._authorized(body):
+            return True
+        logging.warning(f"拒絕未授權的請求: {self.address_string()} {urlparse(self.path).path}")
+        self.send_error(403)
+        return False
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._read_body()
+        # 會改變相機狀態的請求都需要存取權杖
+        if not self._require_token(body):
+            return
+        if path == "/capture":
+            self.server.web_mgr.request_capture()
+            self._send_bytes(b'{"status": "capture requested"}', "application/json", status=202)
+        elif path == "/offload/ack" and self.server.web_mgr.offload_mgr:
+            self._receive_offload_ack(body)
+        else:
+            self.send_error(404)
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return b""
+        return self.rfile.read(length) if length > 0 else b""
+
+    def _authorized(self, body):
+        """權杖可放在 X-Camera-Token 標頭、網址參數或表單欄位 token 中。"""
+        token = self.headers.get("X-Camera-Token")
+        if token is None:
+            token = parse_qs(urlparse(self.path).query).get("token", [None])[0]
+        if token is None and self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            token = parse_qs(body.decode("utf-8", "replace")).get("token", [None])[0]
+        return token is not None and hmac.compare_digest(token.encode("utf-8"), self.server.web_mgr.token.encode("utf-8"))
+
+    def _send_bytes(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self):
+        broadcaster = self.server.web_mgr.broadcaster
+        self.send_response(200)
+        self.send_header("Cache-Control", "no-cache, private")
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=FRAME")
+        self.end_headers()
+
+        broadcaster.add_client()
+        try:
+            sequence = 0
+            while self.server.web_mgr.running:
+                sequence, jpeg = broadcaster.wait_for_frame(sequence)
+                if jpeg is None:
+                    continue
+                self.wfile.write(b"--FRAME\r\nContent-Type: image/jpeg\r\n")
+                self.wfile.write(f"Content-Length: {len(jpeg)}\r\n\r\n".encode("ascii"))
+                self.wfile.write(jpeg)
+                self.wfile.write(b"\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info(f"串流客戶端已中斷: {self.address_string()}")
+        finally:
+            broadcaster.remove_client()
+
+    def _send_photo(self, name):
+        photo_path = self.server.web_mgr.resolve_photo(name)
+        if photo_path is None:
+            self.send_error(404)
+            return
+
+        with open(photo_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", PHOTO_CONTENT_TYPES[os.path.splitext(photo_path)[1]])
+            self.send_header("Content-Length", str(size))
+            self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(photo_path)}"')
+            self.end_headers()
+            # socket.sendfile 在 Linux 上使用 os.sendfile，檔案內容不經過使用者空間
+            self.connection.sendfile(f)
+
+
+    def _send_offload_batch(self, query):
+        """回傳下一批尚未確認的檔案 (tar 串流)；沒有待匯出的檔案時回傳 204。"""
+        offload_mgr = self.server.web_mgr.offload_mgr
+        try:
+            max_bytes = int(query.get("max_bytes", [64 * 1024 * 1024])[0])
+            max_files = int(query.get("max_files", [0])[0]) or None
+        except ValueError:
+            self.send_error(400)
+            return
+
+        batch = offload_mgr.pending_files(max_bytes=max_bytes, max_files=max_files)
+        if not batch:
+            self.send_response(204)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-tar")
+        self.send_header("Content-Length", str(offload_mgr.tar_stream_size(batch)))
+        self.send_header("X-Offload-Files", str(len(batch)))
+        self.end_headers()
+        try:
+            offload_mgr.write_tar(self.connection, batch)
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info(f"匯出客戶端已中斷: {self.address_string()}")
+
+    def _receive_offload_ack(self, body):
+        try:
+            request = json.loads(body)
+            files = request["files"]
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400)
+            return
+        offload_mgr = self.server.web_mgr.offload_mgr
+        confirmed = offload_mgr.acknowledge(files, delete=bool(request.get("delete")))
+        self._send_bytes(json.dumps({"acked": confirmed, "delete_allowed": offload_mgr.allow_delete}).encode("utf-8"), "application/json")
+
+
+def load_or_create_token(token_path):
+    """讀取存取權杖；不存在時產生隨機權杖並以僅限擁有者讀取的權限保存。"""
+    try:
+        with open(token_path, "r") as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(token_path), exist_ok=True)
+    token = secrets.token_urlsafe(16)
+    fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token + "\n")
+    logging.info(f"已產生 HTTP 存取權杖: {token_path}")
+    return token
+
+class WebManager:
+    def __init__(self, save_dir, token, host="0.0.0.0", port=8000, max_fps=10, offload_mgr=None):
+        """
+        本地 HTTP 服務：MJPEG 即時預覽、遠端拍攝以及相片列表與下載。
+        提供 offload_mgr 時另外啟用可續傳的批次匯出 (/offload/manifest、/offload/batch、/offload/ack)。
+        除了首頁以外，預覽串流、相片與 POST 請求 (遠端拍攝、匯出確認) 都必須附上 token；
+        host 可限定只在某個網路介面上提供服務。
+        """
+        if not token:
+            raise ValueError("HTTP 服務需要存取權杖")
+        self.save_dir = save_dir
+        self.token = token
+        self.offload_mgr = offload_mgr
+        self.broadcaster = FrameBroadcaster(max_fps=max_fps)
+        self.capture_event = Event()
+        self.running = True
+
+        self.server = ThreadingHTTPServer((host, port), CameraRequestHandler)
+        self.server.daemon_threads = True
+        self.server.web_mgr = self
+        self.server_thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        logging.info(f"HTTP 服務已啟動: http://{host}:{self.server.server_address[1]}/")
+
+    def publish_frame(self, frame):
+        self.broadcaster.publish(frame)
+
+    def request_capture(self):
+        logging.info("收到遠端拍攝請求")
+        self.capture_event.set()
+
+    def consume_capture_request(self):
+        """若有待處理的遠端拍攝請求則回傳 True，並清除該請求。"""
+        if self.capture_event.is_set():
+            self.capture_event.clear()
+            return True
+        return False
+
+    def list_photos(self):
+        photos = []
+        with os.scandir(self.save_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith(".") and os.path.splitext(entry.name)[1] in PHOTO_CONTENT_TYPES:
+                    stat = entry.stat()
+                    photos.append({"name": entry.name, "size": stat.st_size, "mtime": stat.st_mtime})
+        photos.sort(key=lambda photo: photo["name"])
+        return photos
+
+    def resolve_photo(self, name):
+        """只允許下載保存目錄中的照片與影片，避免路徑穿越；隱藏檔 (例如寫入中的 .part 暫存檔) 一律拒絕。"""
+        if not name or name != os.path.basename(name) or name.startswith("."):
+            return None
+        if os.path.splitext(name)[1] not in PHOTO_CONTENT_TYPES:
+            return None
+        photo_path = os.path.join(self.save_dir, name)
+        return photo_path if os.path.isfile(photo_path) else None
+
+    def close(self):
+        self.running = False
+        self.broadcaster.close()
+        self.server.shutdown()
+        self.server.server_close()
+        logging.info("HTTP 服務已關閉。")
+
+
+if __name__ == "__main__":
+    # 不接相機時以合成畫面在本機測試: python3 web_manager.py [保存目錄]
+    import sys
+    import numpy as np
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    save_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.expanduser("~"), "photo")
+    from offload_manager import OffloadManager
+    token = load_or_create_token(os.path.join(os.path.expanduser("~"), ".pi_camera", "web_token"))
+    web_mgr = WebManager(save_dir, token, host="127.0.0.1", offload_mgr=OffloadManager(save_dir, allow_delete=True))
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    try:
+        while True:
+            frame[:] = 0
+            cv2.putText(frame, time.strftime("%H:%M:%S"), (400, 380), cv2.FONT_HERSHEY_COMPLEX, 3, (255, 255, 255), 3)
+            web_mgr.publish_frame(frame.copy())
+            if web_mgr.consume_capture_request():
+                logging.info("模擬拍攝")
+            time.sleep(1 / 30)
+    except KeyboardInterrupt:
+        web_mgr.close()
@@ -0,0 +1,285 @@
+# writeback_manager.py
+
+import logging
+import os
+import shutil
+import itertools
+import time
+from threading import Condition, Lock, Thread
+from urllib.parse import quote, unquote
+
+import cv2
+
+def write_jpeg(path, image, quality=95):
+    """將影像編碼為 JPEG 並寫入指定路徑 (路徑不需要以 .jpg 結尾)。"""
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        return False
+    with open(path, "wb") as f:
+        f.write(buffer)
+    return True
+
+def _fsync_dir(dir_path):
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class WriteBackManager:
+    def __init__(self, staging_dir="/dev/shm/pi_camera_staging", ram_budget=64 * 1024 * 1024,
+                 flush_interval=2.0, batch_bytes=16 * 1024 * 1024, write_chunk=4 * 1024 * 1024):
+        """
+        以 RAM (tmpfs) 暫存編碼後的檔案，再分批寫回 SD 卡。
+        每批檔案以大區塊連續寫入暫存名稱、fsync 後再 rename 成正式檔名並 fsync 目錄，
+        完成後才回報「已保存」，因此回報後即使斷電照片也不會遺失。
+        RAM 預算用完時改為直接寫入 SD 卡 (同樣經過 fsync 與 rename)。
+        """
+        self.staging_dir = staging_dir
+        self.ram_budget = ram_budget
+        self.flush_interval = flush_interval
+        self.batch_bytes = batch_bytes
+        self.write_chunk = write_chunk  # 配合快閃記憶體的抹除區塊大小，以大區塊寫入
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+        self.reserved = {}  # 寫入中的暫存路徑 -> 預留的位元組數
+        self.pending = []  # 等待寫回的 (暫存路徑, 正式路徑, 大小, 回呼)
+        self.pending_bytes = 0
+        self.staged_bytes = 0  # 目前佔用的 RAM (含預留)
+        self.estimated_size = 8 * 1024 * 1024  # 尚未寫入前以最近的檔案大小估計
+        self.running = True
+        self.flushing = False
+        self.name_counter = itertools.count()
+
+        self._recover()
+        self.flush_thread = Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
+        logging.info(f"寫回暫存區: {self.staging_dir} (RAM 預算 {self.ram_budget / 1e6:.0f} MB)")
+
+    def _unique_suffix(self):
+        # 同一秒內保存的檔案可能有相同的正式路徑，暫存檔名另外加上唯一的編號，避免互相覆蓋而無法釋放預留的 RAM
+        return f"{time.time_ns()}-{next(self.name_counter)}"
+
+    def _staging_name(self, final_path):
+        # 以可還原的方式把正式路徑編碼進暫存檔名，重啟後仍能找回目的地；quote 會把 "#" 編碼，可作為分隔符號
+        return os.path.join(self.staging_dir, quote(final_path, safe="") + "#" + self._unique_suffix())
+
+    def _recover(self):
+        """程式異常結束 (未重新開機) 時，把上次留在 RAM 中已完成的檔案寫回 SD 卡。"""
+        for name in os.listdir(self.staging_dir):
+            staging_path = os.path.join(self.staging_dir, name)
+            if name.endswith(".part"):
+                os.remove(staging_path)
+                continue
+            size = os.path.getsize(staging_path)
+            self.pending.append((staging_path, unquote(name.split("#", 1)[0]), size, None))
+            self.pending_bytes += size
+            self.staged_bytes += size
+        if self.pending:
+            logging.info(f"找到 {len(self.pending)} 個尚未寫回的暫存檔，將重新寫入 SD 卡")
+
+    def begin(self, final_path, estimated_size=None):
+        """
+        取得寫入路徑。RAM 預算足夠時回傳 tmpfs 上的暫存路徑，否則回傳目的地目錄中的暫存檔。
+        檔案寫完後需呼叫 commit()，失敗時呼叫 abort()。
+        """
+        estimated_size = estimated_size or self.estimated_size
+        with self.lock:
+            if self.running and self.staged_bytes + estimated_size <= self.ram_budget:
+                write_path = self._staging_name(final_path) + ".part"
+                self.reserved[write_path] = estimated_size
+                self.staged_bytes += estimated_size
+                return write_path
+        logging.warning(f"RAM 暫存已滿，直接寫入 SD 卡: {final_path}")
+        return os.path.join(os.path.dirname(final_path), f".{os.path.basename(final_path)}.{self._unique_suffix()}.part")
+
+    def commit(self, write_path, final_path, on_saved=None):
+        """
+        檔案寫入完成。暫存於 RAM 的檔案排入下一批寫回，否則立即 fsync 並 rename。
+        close() 之後才完成的暫存檔在呼叫端直接寫回，不會留在沒有執行緒處理的佇列中。
+        """
+        with self.lock:
+            reserved = self.reserved.pop(write_path, None)
+        if reserved is None:
+            ok = self._commit_direct(write_path, final_path)
+            if on_saved:
+                on_saved(final_path, ok)
+            return
+
+        staging_path = write_path[:-len(".part")]
+        try:
+            size = os.path.getsize(write_path)
+            os.replace(write_path, staging_path)
+        except Exception as e:
+            logging.error(f"暫存檔提交失敗: {final_path}: {e}")
+            with self.lock:
+                self.staged_bytes -= reserved
+            for path in (write_path, staging_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            if on_saved:
+                on_saved(final_path, False)
+            return
+        entry = (staging_path, final_path, size, on_saved)
+        with self.condition:
+            self.staged_bytes += size - reserved
+            if size > 1024 * 1024:
+                # 只以照片大小更新估計值，縮略圖不列入
+                self.estimated_size = size
+            if self.running:
+                self.pending.append(entry)
+                self.pending_bytes += size
+                if self.pending_bytes >= self.batch_bytes:
+                    self.condition.notify_all()
+                return
+        # 已呼叫 close() 時寫回執行緒可能已結束，由呼叫端直接寫回這個檔案
+        logging.info(f"寫回暫存區已關閉，直接寫回: {final_path}")
+        self._flush_batch([entry], set())
+
+    def abort(self, write_path):
+        """寫入失敗時移除暫存檔並釋放預留的 RAM。"""
+        with self.lock:
+            reserved = self.reserved.pop(write_path, 0)
+            self.staged_bytes -= reserved
+        try:
+            os.remove(write_path)
+        except FileNotFoundError:
+            pass
+
+    def write_bytes(self, final_path, data, on_saved=None):
+        """寫入已編碼的資料，適用於在行程內完成編碼的情況。"""
+        write_path = self.begin(final_path, len(data))
+        try:
+            with open(write_path, "wb") as f:
+                f.write(data)
+        except Exception as e:
+            logging.error(f"寫入暫存檔失敗: {e}")
+            self.abort(write_path)
+            if on_saved:
+                on_saved(final_path, False)
+            return
+        self.commit(write_path, final_path, on_saved)
+
+    def _commit_direct(self, write_path, final_path):
+        try:
+            with open(write_path, "rb+") as f:
+                os.fsync(f.fileno())
+            os.replace(write_path, final_path)
+            _fsync_dir(os.path.dirname(final_path))
+            return True
+        except Exception as e:
+            logging.error(f"直接寫入失敗: {final_path}: {e}")
+            return False
+
+    def _flush_loop(self):
+        while True:
+            with self.condition:
+                if self.running and self.pending_bytes < self.batch_bytes:
+                    self.condition.wait(timeout=self.flush_interval)
+                if not self.pending:
+                    if not self.running:
+                        break
+                    continue
+                batch, self.pending = self.pending, []
+                self.pending_bytes = 0
+                self.flushing = True
+            finished = set()
+            try:
+                self._flush_batch(batch, finished)
+            except Exception as e:
+                # 任何未預期的錯誤都只影響這一批，寫回執行緒繼續處理之後的照片
+                logging.error(f"寫回批次失敗: {e}")
+                for entry in batch:
+                    if entry[0] not in finished:
+                        self._finish(entry, False, finished)
+            finally:
+                with self.condition:
+                    self.flushing = False
+                    self.condition.notify_all()
+
+    def _flush_batch(self, batch, finished):
+        """
+        把一批暫存檔寫回 SD 卡：連續寫入 -> 逐檔 fsync -> rename -> 每個目錄 fsync 一次。
+        已回報結果的暫存路徑記錄在 finished 中。
+        """
+        start_time = time.monotonic()
+        written = []
+        for entry in batch:
+            staging_path, final_path, size, on_saved = entry
+            temp_path = os.path.join(os.path.dirname(final_path), f".{os.path.basename(final_path)}.{self._unique_suffix()}.part")
+            try:
+                with open(staging_path, "rb") as src, open(temp_path, "wb", buffering=self.write_chunk) as dst:
+                    shutil.copyfileobj(src, dst, self.write_chunk)
+                written.append((entry, temp_path))
+            except Exception as e:
+                logging.error(f"寫回 SD 卡失敗: {final_path}: {e}")
+                self._finish(entry, False, finished)
+
+        # 全部寫完後才逐一 fsync，讓 SD 卡能合併連續的寫入
+        committed = []
+        for entry, temp_path in written:
+            try:
+                with open(temp_path, "rb+") as f:
+                    os.fsync(f.fileno())
+                os.replace(temp_path, entry[1])
+                committed.append(entry)
+            except Exception as e:
+                logging.error(f"寫回 SD 卡失敗: {entry[1]}: {e}")
+                self._finish(entry, False, finished)
+
+        # 目錄 fsync 失敗時無法保證斷電後仍在，該目錄中的檔案回報為失敗
+        synced_dirs = set()
+        for dir_path in {os.path.dirname(entry[1]) for entry in committed}:
+            try:
+                _fsync_dir(dir_path)
+                synced_dirs.add(dir_path)
+            except Exception as e:
+                logging.error(f"目錄 fsync 失敗: {dir_path}: {e}")
+
+        total_bytes = 0
+        saved = 0
+        for entry in committed:
+            ok = os.path.dirname(entry[1]) in synced_dirs
+            self._finish(entry, ok, finished)
+            if ok:
+                saved += 1
+                total_bytes += entry[2]
+        if saved:
+            logging.info(f"已寫回 {saved} 個檔案 ({total_bytes / 1e6:.1f} MB)，耗時 {time.monotonic() - start_time:.2f} 秒")
+
+    def _finish(self, entry, ok, finished):
+        """釋放暫存檔並回報結果，回呼的錯誤不會中斷寫回。"""
+        staging_path, final_path, size, on_saved = entry
+        finished.add(staging_path)
+        self._release(staging_path, size)
+        if on_saved:
+            try:
+                on_saved(final_path, ok)
+            except Exception as e:
+                logging.error(f"保存回呼執行失敗: {e}")
+
+    def _release(self, staging_path, size):
+        try:
+            os.remove(staging_path)
+        except OSError:
+            pass
+        with self.lock:
+            self.staged_bytes -= size
+
+    def flush(self, timeout=30):
+        """立即寫回所有暫存檔並等待完成。"""
+        with self.condition:
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: not self.pending and not self.flushing, timeout=timeout)
+
+    def close(self):
+        """關閉前把所有暫存檔寫回 SD 卡。"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.flush_thread.join(timeout=60)
+        logging.info("寫回暫存區已清空。")